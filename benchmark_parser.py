@@ -0,0 +1,147 @@
+"""
+Benchmarks `split_blog_entries` on a synthetic journal (one file per month), and checks that its output is
+identical to the original parser's (kept below as `reference_process_file`).
+
+Usage: python benchmark_parser.py [years] [posts_per_month]
+"""
+
+import re
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+from tasks.split_blog_entries import Post, process_file
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June"]
+MONTH_NAMES += ["July", "August", "September", "October", "November", "December"]
+TAGS = ["#easydiffusion", "#sdkit", "#freebird", "#ml", "#gamedev", "#tools", "#log"]
+WORDS = "the a model render gpu sdxl image test fix vr ui slow fast memory cache step with for and of".split()
+
+
+def make_journal(years=12, posts_per_month=20, seed=42):
+    "Returns a list of (filename, bytes), in the format of the journal's monthly files"
+    rng = random.Random(seed)
+    files = []
+    for year in range(2014, 2014 + years):
+        for month in range(1, 13):
+            posts = [make_post(rng, year, month) for _ in range(posts_per_month)]
+            text = "\n\n--\n\n".join(posts) + "\n"
+            if rng.random() < 0.1:
+                text = text.replace("\n", "\r\n")  # a few files saved on Windows
+            files.append((f"notes/{MONTH_NAMES[month - 1]} {year}.txt", text.encode()))
+    return files
+
+
+def make_post(rng, year, month):
+    post_time = datetime(year, month, 1) + timedelta(seconds=rng.randrange(27 * 24 * 3600))
+    lines = [post_time.strftime("%a %b %d %H:%M:%S %Y")]
+    if rng.random() < 0.7:
+        lines += [" ".join(rng.sample(TAGS, rng.randint(1, 3)))]
+    if rng.random() < 0.3:
+        lines += ["Title: " + " ".join(rng.choices(WORDS, k=5))]
+    if rng.random() < 0.1:
+        lines += ["slug: " + "-".join(rng.choices(WORDS, k=3))]
+    lines += [""]
+    for _ in range(rng.randint(1, 8)):
+        if rng.random() < 0.2:
+            lines += ["#" + rng.choice(WORDS) + " heading", ""]  # a markdown heading in the body
+        lines += [" ".join(rng.choices(WORDS, k=rng.randint(5, 60))), ""]
+    return "\n".join(lines).strip()
+
+
+def reference_process_file(filename: str, file_contents: bytes) -> list:
+    "The original parser"
+    import os
+
+    dir_path = os.path.dirname(filename)
+    name = os.path.basename(filename)
+    name, ext = os.path.splitext(name)
+
+    if ext.lower() != ".txt":
+        return []
+
+    file_contents = file_contents.decode()
+
+    month_name, year = name.split(" ")
+    month_int = f"{['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'].index(month_name[:3]) + 1:02}"
+
+    posts = re.split(r"\n\s*--\s*\n", file_contents.strip())
+
+    post_list = []
+    for i, post in enumerate(posts):
+        post = post.strip()
+        if post:
+            data = reference_process_post(post)
+            key = f"{dir_path}/{year}/{month_int}/{data.id}"
+            post_list.append((key, data))
+
+    return post_list
+
+
+def reference_process_post(post_contents: str) -> Post:
+    lines = post_contents.strip().splitlines()
+
+    post_date = lines[0]
+    post_time = datetime.strptime(post_date, "%a %b %d %H:%M:%S %Y")
+    post_id = str(int(post_time.timestamp()))
+
+    tags = []
+    title = None
+
+    idx = 1
+    while idx < len(lines):
+        line = lines[idx].strip()
+        if not line:
+            idx += 1
+            continue
+        if re.match(r"^#\S+", line):
+            tags += [tag for tag in line.split()]
+            idx += 1
+            continue
+        if line.lower().startswith("title: "):
+            title = line[len("title: ") :].strip()
+            idx += 1
+            continue
+        if line.lower().startswith("slug: "):
+            post_id = line[len("slug: ") :].strip()
+            idx += 1
+            continue
+        break
+
+    post_body = "\n".join(lines[idx:]).strip()
+
+    if title:
+        post_body = f"# {title}\n\n{post_body}"
+
+    return Post(post_id, post_time, tags, post_body, title)
+
+
+def benchmark(parse, files, repeat=5):
+    "Returns the best time (seconds) to parse all the files, and the number of posts"
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_posts = sum(len(parse(filename, contents)) for filename, contents in files)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, num_posts
+
+
+def main(years=12, posts_per_month=20):
+    files = make_journal(years, posts_per_month)
+
+    for filename, contents in files:
+        if process_file(filename, contents) != reference_process_file(filename, contents):
+            raise Exception(f"The output of the parser is different from the original parser, for {filename}")
+
+    num_bytes = sum(len(contents) for _, contents in files)
+    print(f"{len(files)} files, {num_bytes / 1024 / 1024:.1f} MB")
+
+    for name, parse in (("original", reference_process_file), ("current", process_file)):
+        elapsed, num_posts = benchmark(parse, files)
+        print(f"{name}: {num_posts} posts in {elapsed * 1000:.1f} ms, {num_posts / elapsed:.0f} posts/sec")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
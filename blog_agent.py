@@ -3,8 +3,11 @@ import hmac
 from hashlib import sha256
 
 import workflow
+from liteflow import Tracer
+from tasks import http_pool, github_client
 
 DROPBOX_APP_SECRET = os.environ.get("DROPBOX_APP_SECRET", "your-dropbox-app-secret")
+TRACE_WORKFLOW = os.environ.get("TRACE_WORKFLOW", "0") == "1"
 
 
 def lambda_handler(event, context):
@@ -28,6 +31,12 @@ def lambda_handler(event, context):
 
     # Run the workflow
     print("Running workflow...")
-    workflow.run()
+    tracer = Tracer() if TRACE_WORKFLOW else None
+    workflow.run(tracer=tracer)
+
+    if tracer:
+        print("Workflow trace:", tracer.to_json())
+    print("HTTP connections:", http_pool.pool.stats())
+    print("GitHub API:", github_client.client.stats())
 
     return {"statusCode": 200, "body": "Publish successful!"}
@@ -1,30 +1,900 @@
-def run(workflow, data=None):
+import os
+import copy
+import time
+import queue
+import json
+import pickle
+import hashlib
+import asyncio
+import inspect
+import threading
+import tracemalloc
+import multiprocessing
+import multiprocessing.connection
+from functools import partial
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+
+def run(workflow, data=None, max_workers=None, tracer=None, stream=False, stream_buffer=64):
+    """
+    Runs the workflow on the given data, and returns the result.
+    - workflow: a task (a callable, or an object with a `run` method), a list/tuple of tasks (run in sequence),
+      a set of tasks (run in parallel), or a dict of tasks (runs the branches whose key matches the data, in parallel).
+    - max_workers: optional cap on the number of tasks that can run at the same time in this workflow.
+    - tracer: optional `Tracer` (or a callback function that receives each span) to record the timings of every task.
+    - stream: if True, generators returned by tasks are passed lazily to the next task, instead of being
+      converted to lists. See below.
+    - stream_buffer: the number of items that a streamed parallel branch can fall behind by, before the
+      other branches have to wait for it.
+
+    The results of parallel branches are returned as a list, in the same order that the branches were iterated in.
+    If a branch fails, the branches that haven't started yet are cancelled, and the first error is raised.
+
+    In streaming mode, tasks can be generators (or return generators), and each item flows through the sequence
+    of tasks as soon as it's produced. When a generator is fed to parallel branches, each branch gets its own
+    iterator over the same items, and all the branches run at the same time (ignoring `max_workers`). The
+    generator doesn't run ahead of the slowest branch by more than `stream_buffer` items. If the first task of a
+    branch has an `accepts(item)` method, the branch only receives the items that it accepts (e.g. the posts of one
+    blog), instead of every item. The branch predicates of dicts receive the generator itself, and the tracer only
+    measures the time taken to create each generator.
+    """
+    ctx = _Context(max_workers, tracer, stream, stream_buffer)
+    with ctx.tracing():
+        return _run(workflow, data, ctx)
+
+
+class _Context:
+    def __init__(self, max_workers=None, tracer=None, stream=False, stream_buffer=64):
+        self.max_workers = max_workers
+        self.slots = threading.BoundedSemaphore(max_workers) if max_workers else None
+        self.tracer = _make_tracer(tracer)
+        self.stream = stream
+        self.stream_buffer = stream_buffer
+
+    def tracing(self):
+        return self.tracer.tracing() if self.tracer else nullcontext()
+
+    def span(self, kind, name, path, data, measure_cpu=True):
+        if self.tracer is None:
+            return nullcontext()
+        return self.tracer.span(kind, name, path, data, measure_cpu)
+
+
+def _run(workflow, data, ctx, path=()):
     if isinstance(workflow, (list, tuple)):  # sequential tasks
-        for item in workflow:
-            data = run(item, data)
+        with ctx.span("sequence", "sequence", path, data) as span:
+            for i, item in enumerate(workflow):
+                data = _run(item, data, ctx, path + (i,))
 
-        return data
+            _record_output(span, data)
+            return data
 
     if isinstance(workflow, dict):  # branching tasks
-        new_data = []
-        for key, value in workflow.items():
-            if callable(key) and key(data):  # branch based on a function
-                d = run(value, data)
-                new_data.append(d)
-            elif key == data:  # branch based on a key match
-                d = run(value, data)
-                new_data.append(d)
-        return new_data
+        return _run_parallel("dict", _select_branches(workflow, data), data, ctx, path)
 
     if isinstance(workflow, set):  # parallel tasks
-        new_data = []
-        for item in workflow:
-            d = run(item, data)
-            new_data.append(d)
-        return new_data
+        return _run_parallel("set", list(workflow), data, ctx, path)
 
     if callable(workflow):
-        return workflow(data)
+        return _call(workflow, data, ctx, path)
 
     if hasattr(workflow, "run"):
-        return workflow.run(data)
+        return _call(workflow.run, data, ctx, path)
+
+
+def _call(task, data, ctx, path):
+    with ctx.slots or nullcontext(), ctx.span("task", task_name(task), path, data) as span:
+        result = task(data)
+
+        if inspect.isawaitable(result):  # coroutine tasks get their own event loop in the sync runner
+            result = asyncio.run(_await(result))
+        if inspect.isgenerator(result) and not ctx.stream:
+            result = list(result)
+
+        _record_output(span, result)
+        return result
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def _select_branches(workflow, data):
+    branches = []
+    for key, value in workflow.items():
+        if callable(key) and key(data):  # branch based on a function
+            branches.append(value)
+        elif key == data:  # branch based on a key match
+            branches.append(value)
+    return branches
+
+
+def _run_parallel(kind, branches, data, ctx, path):
+    with ctx.span("parallel", kind, path, data) as span:
+        if ctx.stream and len(branches) > 1 and inspect.isgenerator(data):
+            results = _run_streamed(branches, data, ctx, path)
+        elif len(branches) <= 1 or ctx.max_workers == 1:
+            results = [_run(branch, data, ctx, path + (i,)) for i, branch in enumerate(branches)]
+        else:
+            jobs = [(_run, branch, data, ctx, path + (i,)) for i, branch in enumerate(branches)]
+            results = _run_in_threads(jobs, min(len(branches), ctx.max_workers or len(branches)))
+
+        _record_output(span, results)
+        return results
+
+
+def _run_in_threads(jobs, num_threads):
+    with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="liteflow") as executor:
+        futures = [executor.submit(*job) for job in jobs]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+        failed = [future for future in futures if future in done and future.exception() is not None]
+        if failed:
+            for future in not_done:
+                future.cancel()
+            raise failed[0].exception()
+
+        return [future.result() for future in futures]
+
+
+def _run_streamed(branches, data, ctx, path):
+    # every branch needs to keep consuming its stream, otherwise the other branches would wait on it forever
+    ctx = copy.copy(ctx)
+    ctx.slots = None
+
+    tee = _Tee(data, [_get_accepts(branch) for branch in branches], ctx.stream_buffer)
+    jobs = [(_run_tee_branch, branch, tee, i, ctx, path + (i,)) for i, branch in enumerate(branches)]
+    tee.start()
+    return _run_in_threads(jobs, len(branches))
+
+
+def _get_accepts(branch):
+    "Returns the `accepts(item)` method of the first task of the branch, if it has one"
+    while isinstance(branch, (list, tuple)) and branch:
+        branch = branch[0]
+    return getattr(branch, "accepts", None)
+
+
+def _run_tee_branch(branch, tee, i, ctx, path):
+    try:
+        result = _run(branch, tee.iterator(i), ctx, path)
+        if inspect.isgenerator(result):  # drain the branch here, since nothing downstream will
+            result = list(result)
+        return result
+    finally:
+        tee.close(i)
+
+
+class _Tee:
+    """
+    Copies the items of a generator into a bounded queue per consumer, from a separate thread. `accepts` has a
+    function (or None) for each consumer, that selects the items that are sent to it.
+    """
+
+    _END = object()
+
+    def __init__(self, source, accepts, maxsize):
+        self.source = source
+        self.accepts = accepts
+        self.queues = [queue.Queue(maxsize) for _ in accepts]
+        self.closed = [False] * len(accepts)
+        self.thread = threading.Thread(target=self._produce, name="liteflow-tee", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def iterator(self, i):
+        q = self.queues[i]
+        while True:
+            item, error = q.get()
+            if item is self._END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+
+    def close(self, i):
+        "Stops sending items to a consumer that has finished (or failed), so that it doesn't block the others"
+        self.closed[i] = True
+        try:
+            while True:
+                self.queues[i].get_nowait()
+        except queue.Empty:
+            pass
+
+    def _produce(self):
+        end = (self._END, None)
+        try:
+            for item in self.source:
+                for i, accepts in enumerate(self.accepts):
+                    if accepts is None or accepts(item):
+                        self._put(i, (item, None))
+        except BaseException as e:
+            end = (self._END, e)
+
+        for i in range(len(self.queues)):
+            self._put(i, end)
+
+    def _put(self, i, entry):
+        if not self.closed[i]:
+            self.queues[i].put(entry)
+
+
+async def run_async(workflow, data=None, max_workers=None, tracer=None):
+    """
+    Async version of `run()`. Tasks can be coroutine functions, or regular functions (which are run in the
+    event loop's default executor, so that they don't block the loop).
+    - max_workers: optional cap on the number of tasks that can run at the same time in this workflow.
+    - tracer: optional `Tracer` (or a callback function that receives each span) to record the timings of every task.
+
+    Sequences are awaited in order, and the branches of sets and dicts are run concurrently using `asyncio.gather()`.
+    Generators returned by tasks are converted to lists (streaming is only supported by `run()`).
+
+    It only helps workflows whose I/O tasks are coroutines. The blog workflow uses `run()`, since its tasks call the
+    blocking HTTP connection pool (and already run their requests in parallel, on thread pools).
+    """
+    ctx = _AsyncContext(max_workers, tracer)
+    with ctx.tracing():
+        return await _run_async(workflow, data, ctx)
+
+
+class _AsyncContext(_Context):
+    def __init__(self, max_workers=None, tracer=None):
+        super().__init__(None, tracer)
+        self.max_workers = max_workers
+        self.slots = asyncio.Semaphore(max_workers) if max_workers else None
+
+
+async def _run_async(workflow, data, ctx, path=()):
+    if isinstance(workflow, (list, tuple)):  # sequential tasks
+        # CPU time isn't measured for async groups, since other coroutines share the same thread
+        with ctx.span("sequence", "sequence", path, data, measure_cpu=False) as span:
+            for i, item in enumerate(workflow):
+                data = await _run_async(item, data, ctx, path + (i,))
+
+            _record_output(span, data)
+            return data
+
+    if isinstance(workflow, dict):  # branching tasks
+        return await _run_parallel_async("dict", _select_branches(workflow, data), data, ctx, path)
+
+    if isinstance(workflow, set):  # parallel tasks
+        return await _run_parallel_async("set", list(workflow), data, ctx, path)
+
+    if callable(workflow):
+        return await _call_async(workflow, data, ctx, path)
+
+    if hasattr(workflow, "run"):
+        return await _call_async(workflow.run, data, ctx, path)
+
+
+async def _call_async(task, data, ctx, path):
+    async with ctx.slots or nullcontext():
+        if _is_coroutine_function(task):
+            with ctx.span("task", task_name(task), path, data, measure_cpu=False) as span:
+                result = await task(data)
+                _record_output(span, result)
+                return result
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, _call_in_executor, task, data, ctx, path)
+
+        if inspect.isawaitable(result):
+            result = await result
+
+        return result
+
+
+def _call_in_executor(task, data, ctx, path):
+    with ctx.span("task", task_name(task), path, data) as span:
+        result = task(data)
+        if inspect.isgenerator(result):
+            result = list(result)
+
+        _record_output(span, result)
+        return result
+
+
+def _is_coroutine_function(task):
+    return inspect.iscoroutinefunction(task) or inspect.iscoroutinefunction(getattr(task, "__call__", None))
+
+
+async def _run_parallel_async(kind, branches, data, ctx, path):
+    with ctx.span("parallel", kind, path, data, measure_cpu=False) as span:
+        tasks = [asyncio.ensure_future(_run_async(branch, data, ctx, path + (i,))) for i, branch in enumerate(branches)]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        _record_output(span, results)
+        return results
+
+
+class Tracer:
+    """
+    Records a span for every task, sequence and parallel group that runs in a workflow.
+
+    Each span is a dict with: `kind`, `name`, `path` (the position of the task in the workflow), `thread`,
+    `start` and `wall_time` (seconds, relative to when the tracer was created), `cpu_time` (seconds),
+    `items_in` and `items_out` (the length of the input and output, if they have one), `mem_delta` (the peak
+    memory allocated during the task, in bytes) and `error` (if the task raised an exception).
+
+    Memory is measured using `tracemalloc`, whose peak is process-wide. So `mem_delta` is only measured for tasks
+    that didn't overlap with another task, and is None for the tasks that ran in parallel. Pass
+    `trace_memory=False` to skip it (tracemalloc slows down allocation-heavy tasks).
+    - callback: optional function, called with each span as soon as it finishes.
+    """
+
+    def __init__(self, callback=None, trace_memory=True):
+        self.spans = []
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._open_tasks = {}  # id(span) -> True if the task overlapped with another one
+
+    @contextmanager
+    def tracing(self):
+        started_tracemalloc = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        try:
+            yield self
+        finally:
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+    @contextmanager
+    def span(self, kind, name, path, data=None, measure_cpu=True):
+        span = {
+            "kind": kind,
+            "name": name,
+            "path": list(path),
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(),
+            "start": None,
+            "wall_time": None,
+            "cpu_time": None,
+            "items_in": _count(data),
+            "items_out": None,
+            "mem_delta": None,
+            "error": None,
+        }
+
+        trace_memory = kind == "task" and tracemalloc.is_tracing()
+        if trace_memory:
+            with self._lock:
+                overlapped = bool(self._open_tasks)
+                for span_id in self._open_tasks:
+                    self._open_tasks[span_id] = True
+                self._open_tasks[id(span)] = overlapped
+                if not overlapped:  # resetting the peak would hide the peaks of the other open tasks
+                    mem_start = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+
+        cpu_start = time.thread_time() if measure_cpu else None
+        wall_start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = repr(e)
+            raise
+        finally:
+            span["start"] = wall_start - self._origin
+            span["wall_time"] = time.perf_counter() - wall_start
+            if measure_cpu:
+                span["cpu_time"] = time.thread_time() - cpu_start
+            with self._lock:
+                if trace_memory and not self._open_tasks.pop(id(span)):
+                    span["mem_delta"] = max(tracemalloc.get_traced_memory()[1] - mem_start, 0)
+                self.spans.append(span)
+
+            if self.callback:
+                self.callback(span)
+
+    def to_json(self, **kwargs):
+        "Returns the recorded spans as a JSON string, ordered by their start time"
+        return json.dumps(sorted(self.spans, key=lambda span: span["start"]), **kwargs)
+
+    def to_chrome_trace(self):
+        """
+        Returns the spans in the Chrome Trace Event format, which can be opened in `chrome://tracing`,
+        https://ui.perfetto.dev or https://www.speedscope.app (as a flamegraph).
+        """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in self.spans:
+            threads[span["tid"]] = span["thread"]
+            args = {k: span[k] for k in ("path", "cpu_time", "items_in", "items_out", "mem_delta", "error")}
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["kind"],
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["wall_time"] * 1e6,
+                    "pid": pid,
+                    "tid": span["tid"],
+                    "args": args,
+                }
+            )
+
+        for tid, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+def _make_tracer(tracer):
+    if tracer is None or isinstance(tracer, Tracer):
+        return tracer
+    return Tracer(callback=tracer)
+
+
+def _record_output(span, result):
+    if span is not None:
+        span["items_out"] = _count(result)
+
+
+def _count(data):
+    if data is None or isinstance(data, (str, bytes)):
+        return None
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+
+SECRET_ARGS = ("token", "secret", "password", "key")
+
+
+def task_name(task):
+    """
+    Returns a readable name for the task, e.g. `tasks.publish_to_github.run(owner='cmdr2', ...)`.
+    The arguments of `functools.partial` tasks are included, except ones that look like secrets.
+    """
+    if isinstance(task, partial):
+        args = [repr(arg) for arg in task.args]
+        for k, v in task.keywords.items():
+            if any(secret in k.lower() for secret in SECRET_ARGS):
+                args.append(f"{k}=***")
+            else:
+                args.append(f"{k}={v!r}")
+        return f"{task_name(task.func)}({', '.join(args)})"
+
+    if isinstance(task, _TaskWrapper):
+        return task.name
+
+    if inspect.ismodule(task):
+        return task.__name__
+
+    name = getattr(task, "__qualname__", None) or type(task).__qualname__
+    module = getattr(task, "__module__", None) or type(task).__module__
+    return f"{module}.{name}" if module else name
+
+
+def _stable_name(task):
+    """
+    Like `task_name()`, but stable across processes (for cache keys): secrets aren't masked, and objects without
+    their own `__repr__` (e.g. stores) are identified by their type instead of their address.
+    """
+    if isinstance(task, partial):
+        args = [_stable_repr(arg) for arg in task.args]
+        args += [f"{k}={_stable_repr(v)}" for k, v in sorted(task.keywords.items())]
+        return f"{_stable_name(task.func)}({', '.join(args)})"
+
+    if isinstance(task, _TaskWrapper):
+        return f"{type(task).__name__.lower()}({_stable_name(task.__wrapped__)})"
+
+    return task_name(task)
+
+
+def _stable_repr(value):
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({', '.join(_stable_repr(v) for v in value)})"
+    if isinstance(value, (set, frozenset)):
+        return f"{type(value).__name__}({', '.join(sorted(_stable_repr(v) for v in value))})"
+    if isinstance(value, dict):
+        items = sorted(f"{_stable_repr(k)}: {_stable_repr(v)}" for k, v in value.items())
+        return f"dict({', '.join(items)})"
+    if isinstance(value, partial) or inspect.isroutine(value) or inspect.ismodule(value) or inspect.isclass(value):
+        return _stable_name(value)
+    if type(value).__repr__ is object.__repr__:
+        return f"<{type(value).__module__}.{type(value).__qualname__}>"
+    return repr(value)
+
+
+class _TaskWrapper:
+    "Base class for the wrappers that change how a task runs (e.g. `cached()`)"
+
+    def __init__(self, task):
+        self.__wrapped__ = task
+        self.task = task.run if inspect.ismodule(task) else task
+
+    @property
+    def name(self):
+        return f"{type(self).__name__.lower()}({task_name(self.__wrapped__)})"
+
+    def __call__(self, data):
+        return self.task(data)
+
+
+def cached(task, store, version=None):
+    """
+    Wraps the task so that its output is cached in the given store, keyed by a hash of the task's name (including
+    the arguments of `functools.partial` tasks), `version` and the input data. Use it only for tasks that don't have
+    side effects, e.g. `cached(split_blog_entries, MemoryStore())`. Arguments without their own `__repr__` (e.g. a
+    store) are identified only by their type.
+    - store: a store (see below), e.g. `MemoryStore`, `DiskStore`, `S3Store` or `TieredStore`.
+    - version: change this when the task's code changes, to ignore the outputs cached by the older code.
+
+    Inputs that can't be pickled (e.g. open files) aren't cached. Generator outputs are converted to lists.
+    """
+    return Cached(task, store, version)
+
+
+class Cached(_TaskWrapper):
+    def __init__(self, task, store, version=None):
+        super().__init__(task)
+        self.store = store
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, data):
+        try:
+            data = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+
+        h = hashlib.sha256()
+        h.update(_stable_name(self.__wrapped__).encode())
+        h.update(f"\0{self.version}\0".encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def __call__(self, data):
+        key = self.cache_key(data)
+        if key is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self.hits += 1
+                return pickle.loads(value)
+
+        self.misses += 1
+        result = self.task(data)
+        if inspect.isgenerator(result):
+            result = list(result)
+
+        if key is not None:
+            self.store.put(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+
+        return result
+
+
+# A store keeps bytes values by string keys. It has two methods: `get(key)`, which returns the value (or None if
+# there isn't one), and `put(key, value)`. Stores can drop entries at any time (e.g. to stay within a size limit),
+# and need to be safe to use from multiple threads. Any object with these methods can be used as a store.
+
+
+class MemoryStore:
+    """
+    In-process cache store, which lasts as long as the process (e.g. across the invocations of a warm Lambda).
+    The least-recently used entries are evicted once the total size of the values exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old_value = self._entries.pop(key, None)
+            if old_value is not None:
+                self._size -= len(old_value)
+
+            self._entries[key] = value
+            self._size += len(value)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class DiskStore:
+    """
+    Cache store that saves each entry as a file in `dir_path` (e.g. in `/tmp`, which survives between the
+    invocations of a warm Lambda). The least-recently used files are deleted once their total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, dir_path, max_bytes=256 * 1024 * 1024):
+        self.dir_path = dir_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(dir_path, exist_ok=True)
+        self._size = sum(size for _, _, size in self._list_files())
+
+    def get(self, key):
+        file_path = os.path.join(self.dir_path, key)
+        try:
+            with open(file_path, "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(file_path)  # mark as recently used
+        except FileNotFoundError:  # evicted by a concurrent `put()`
+            pass
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        file_path = os.path.join(self.dir_path, key)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, file_path)
+
+        with self._lock:
+            self._size += len(value)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._list_files())  # oldest first
+        self._size = sum(size for _, _, size in files)
+        for _, file_path, size in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def __getstate__(self):  # e.g. to pass the store to tasks running in a process pool
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _list_files(self):
+        files = []
+        for entry in os.scandir(self.dir_path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+
+class S3Store:
+    """
+    Cache store that saves each entry as an object in an S3 (or S3-compatible) bucket, under `prefix`.
+    S3 doesn't track access times, so entries aren't evicted here. Use a lifecycle rule on the bucket to expire
+    old entries.
+    - client: optional boto3 S3 client, e.g. one created with an `endpoint_url` for S3-compatible stores.
+    """
+
+    def __init__(self, bucket, prefix="", client=None):
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def put(self, key, value):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=value)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+
+class TieredStore:
+    """
+    Combines cache stores, from the fastest to the slowest, e.g. `TieredStore(MemoryStore(), DiskStore(path))`.
+    Entries are written to every store, and an entry that's found in a slower store is copied to the faster ones.
+    """
+
+    def __init__(self, *stores):
+        self.stores = stores
+
+    def get(self, key):
+        for i, store in enumerate(self.stores):
+            value = store.get(key)
+            if value is not None:
+                for faster_store in self.stores[:i]:
+                    faster_store.put(key, value)
+                return value
+        return None
+
+    def put(self, key, value):
+        for store in self.stores:
+            store.put(key, value)
+
+
+def sharded(task, max_processes=None):
+    """
+    Runs the task on shards of its input list in separate processes, and joins the outputs of the shards in order.
+    Use it for CPU-bound tasks that process each item of their input independently, e.g. `sharded(split_blog_entries)`.
+    The task, its input items and its output items need to be picklable.
+
+    The shards are sent to the processes through pipes, which (unlike process pools) work on AWS Lambda, since they
+    don't need `/dev/shm`. The processes are started with "forkserver" (or "spawn"), because forking a process that
+    has other threads running (e.g. an HTTP connection pool) isn't safe. These start methods import the main module
+    again in each process, so the script that runs the workflow needs an `if __name__ == "__main__"` guard.
+
+    Runs the task in-process if only one CPU is available, or if the processes can't be started (or exit before
+    sending back their outputs). Errors raised by the task are raised again in this process.
+    - max_processes: optional cap on the number of processes. Defaults to the number of available CPUs.
+    """
+    return Sharded(task, max_processes)
+
+
+class Sharded(_TaskWrapper):
+    SHARDS_PER_PROCESS = 4  # smaller shards balance the load better, if some items take longer than others
+
+    def __init__(self, task, max_processes=None):
+        super().__init__(task)
+        self.max_processes = max_processes
+
+    def __call__(self, data):
+        items = list(data)
+        num_processes = min(self.max_processes or _available_cpus(), len(items))
+        if num_processes <= 1:
+            return _run_shard(self.task, items)
+
+        num_shards = min(num_processes * self.SHARDS_PER_PROCESS, len(items))
+        shard_size = -(-len(items) // num_shards)  # ceil
+        shards = [items[i : i + shard_size] for i in range(0, len(items), shard_size)]
+
+        workers = []
+        try:
+            for _ in range(num_processes):
+                workers.append(_ShardProcess(self.task))
+        except (OSError, NotImplementedError, ImportError) as e:
+            for worker in workers:
+                worker.stop()
+            print(f"Processes aren't available ({e!r}), running {self.name} in-process")
+            return _run_shard(self.task, items)
+
+        try:
+            outputs = _map_shards(workers, shards)
+        except _ProcessFailed as e:
+            print(f"{e}, running {self.name} in-process")
+            return _run_shard(self.task, items)
+        finally:
+            for worker in workers:
+                worker.stop()
+
+        return [item for output in outputs for item in output]
+
+
+class _ProcessFailed(Exception):
+    "A shard process exited (e.g. while starting up) before sending back its output"
+
+
+def _map_shards(workers, shards):
+    "Sends the next shard to each process as soon as it's done with its previous one"
+    outputs = [None] * len(shards)
+    pending = list(enumerate(shards))
+    busy = {}  # connection -> worker
+
+    for worker in workers[: len(pending)]:
+        _send_shard(worker.conn, pending.pop(0))
+        busy[worker.conn] = worker
+
+    while busy:
+        for conn in multiprocessing.connection.wait(list(busy)):
+            worker = busy.pop(conn)
+            try:
+                i, output, error = conn.recv()
+            except (EOFError, OSError) as e:
+                raise _ProcessFailed(f"A shard process exited unexpectedly ({e!r})") from e
+            if error is not None:
+                raise error
+
+            outputs[i] = output
+            if pending:
+                _send_shard(conn, pending.pop(0))
+                busy[conn] = worker
+
+    return outputs
+
+
+def _send_shard(conn, shard):
+    try:
+        conn.send(shard)
+    except OSError as e:  # e.g. BrokenPipeError, if the process has already exited
+        raise _ProcessFailed(f"A shard process exited unexpectedly ({e!r})") from e
+
+
+class _ShardProcess:
+    "A process that runs the task on each shard that it receives through a pipe, and sends back the output"
+
+    def __init__(self, task):
+        methods = multiprocessing.get_all_start_methods()
+        mp = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=_shard_worker, args=(child_conn, task), daemon=True)
+        try:
+            self.process.start()
+        finally:
+            child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def _shard_worker(conn, task):
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        i, items = job
+        try:
+            conn.send((i, _run_shard(task, items), None))
+        except Exception as e:
+            conn.send((i, None, e))
+
+
+def _run_shard(task, items):
+    result = task(items)
+    return list(result) if inspect.isgenerator(result) else result
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
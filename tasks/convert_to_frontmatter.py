@@ -1,17 +1,42 @@
+from tasks.track_changes import get_fingerprint
+
+RENDER_VERSION = 1  # change this when the output format changes, to ignore the cached renders
+
+
 def run(files, **kwargs):
+    """
+    Yields tuples of (filepath, content) for each (key, Post).
+    - cms: "hugo" (default), "jekyll" or "mkdocs".
+    - cache: optional liteflow store for the rendered posts, keyed by the post's fingerprint and the cms. Can be
+      shared by multiple targets.
+    """
     cms = kwargs.get("cms", "hugo")
-    file_list = [process_file(filename, post, cms) for filename, post in files]
-    return file_list
+    cache = kwargs.get("cache")
+    for filename, post in files:
+        yield process_file(filename, post, cms, cache)
+
 
+def process_file(filename: str, post, cms, cache=None) -> list:
+    filepath = get_filepath(post)
 
-def process_file(filename: str, post, cms) -> list:
-    filepath = post.time.strftime("%Y-%m-%d") + "-" + post.id + ".md"
+    if cache is None:
+        return filepath, format_content(post, cms)
+
+    key = f"render-{RENDER_VERSION}-{cms}-{get_fingerprint(post)}"
+    content = cache.get(key)
+    if content is not None:
+        return filepath, content.decode()
 
     content = format_content(post, cms)
+    cache.put(key, content.encode())
 
     return filepath, content
 
 
+def get_filepath(post) -> str:
+    return post.time.strftime("%Y-%m-%d") + "-" + post.id + ".md"
+
+
 def format_content(post, cms):
     if cms == "hugo":
         tag_label, post_date = get_hugo_frontmatter(post.time)
@@ -45,7 +70,7 @@ def format_content(post, cms):
     front_matter = "---\n" + front_matter + "\n---\n"
 
     # Combine front matter and post body
-    content = front_matter + "\n" + post.body
+    content = front_matter + "\n" + post.render_body()
 
     return content
 
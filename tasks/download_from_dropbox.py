@@ -1,40 +1,294 @@
 import os
-import io
 import json
-import http.client
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tasks import http_pool
 
 DROPBOX_REFRESH_TOKEN = os.environ.get("DROPBOX_REFRESH_TOKEN", "your-dropbox-refresh-token")
 DROPBOX_APP_KEY = os.environ.get("DROPBOX_APP_KEY", "your-dropbox-app-key")
 DROPBOX_APP_SECRET = os.environ.get("DROPBOX_APP_SECRET", "your-dropbox-app-secret")
 DROPBOX_FOLDER_PATH = os.environ.get("DROPBOX_FOLDER_PATH", "/your-journal-folder-in-dropbox/")
+DROPBOX_MIRROR_DIR = os.environ.get("DROPBOX_MIRROR_DIR", "/tmp/dropbox-mirror")
+DROPBOX_ZIP_MAX_MEMORY = int(os.environ.get("DROPBOX_ZIP_MAX_MEMORY", 4 * 1024 * 1024))  # bigger zips go to TEMP_DIR
+DROPBOX_TOKEN_CACHE_PATH = os.environ.get("DROPBOX_TOKEN_CACHE_PATH")  # optional, e.g. "/tmp/dropbox-token.json"
+
+# can be pointed to a local server for testing
+DROPBOX_AUTH_URL = os.environ.get("DROPBOX_AUTH_URL", "https://api.dropbox.com")
+DROPBOX_API_URL = os.environ.get("DROPBOX_API_URL", "https://api.dropboxapi.com")
+DROPBOX_CONTENT_URL = os.environ.get("DROPBOX_CONTENT_URL", "https://content.dropboxapi.com")
+
+MAX_PARALLEL_DOWNLOADS = 8
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+TEMP_DIR = os.environ.get("TEMP_DIR", "/tmp")
+
+TOKEN_EXPIRY_MARGIN = 5 * 60  # don't use tokens that expire sooner than this (seconds)
+TOKEN_BACKGROUND_REFRESH = 20 * 60  # refresh tokens in the background when they expire sooner than this (seconds)
 
 
 def run(data, **kwargs):
-    # Step 1: Refresh the access token using the refresh token
-    new_access_token = refresh_access_token()
+    # Step 1: Get an access token (cached, or refreshed using the refresh token)
+    new_access_token = get_access_token()
 
     # Step 2: Use the new access token to download the zip
     dropbox_folder_path = ensure_slashes(DROPBOX_FOLDER_PATH, start=True, end=False)
 
-    conn = http.client.HTTPSConnection("content.dropboxapi.com")
     body = json.dumps({"path": dropbox_folder_path})
     headers = {"Authorization": f"Bearer {new_access_token}", "Dropbox-API-Arg": body}
 
-    conn.request("POST", "/2/files/download_zip", headers=headers, body=body)
-    response = conn.getresponse()
+    # stream the zip to a temporary file, which stays in memory only if it's small
+    zip_file = tempfile.SpooledTemporaryFile(max_size=DROPBOX_ZIP_MAX_MEMORY, dir=TEMP_DIR)
+
+    url = f"{DROPBOX_CONTENT_URL}/2/files/download_zip"
+    with http_pool.stream("POST", url, headers=headers, body=body) as response:
+        if response.status != 200:
+            raise Exception(f"Dropbox API request failed with status {response.status}: {response.reason}")
+
+        shutil.copyfileobj(response, zip_file, DOWNLOAD_CHUNK_SIZE)
+
+    zip_file.seek(0)
+    return zip_file
+
+
+def sync(data, **kwargs):
+    """
+    Incrementally syncs the Dropbox folder to a local mirror (in DROPBOX_MIRROR_DIR), and returns a list of
+    tuples (filename, contents) for all the files in the folder. The filenames match the ones in `download_zip`,
+    i.e. they start with the name of the folder.
+
+    The `list_folder` cursor is saved after each sync, so the next sync downloads only the files that changed
+    since then (in parallel). The first sync (e.g. on a cold Lambda) downloads every file.
+    """
+    access_token = get_access_token()
+
+    dropbox_folder_path = ensure_slashes(DROPBOX_FOLDER_PATH, start=True, end=False)
+    mirror = Mirror(DROPBOX_MIRROR_DIR, dropbox_folder_path)
+
+    entries, cursor = None, mirror.cursor
+    if cursor:
+        try:
+            entries, cursor = list_folder_changes(access_token, cursor=cursor)
+        except CursorResetError:
+            print("Dropbox cursor was reset, doing a full sync")
+
+    if entries is None:
+        mirror.clear()
+        entries, cursor = list_folder_changes(access_token, folder_path=dropbox_folder_path)
+
+    changed_files = []
+    for entry in entries:
+        if entry[".tag"] == "deleted":
+            mirror.remove(entry["path_lower"])
+        elif entry[".tag"] == "file":
+            changed_files.append(entry)
+
+    print(f"Dropbox sync: {len(changed_files)} changed files, {len(entries) - len(changed_files)} other changes")
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS) as executor:
+        contents = executor.map(lambda entry: download_file(access_token, entry["path_lower"]), changed_files)
+        for entry, file_contents in zip(changed_files, contents):
+            mirror.write(entry["path_lower"], entry["path_display"], file_contents)
+
+    mirror.save(cursor)  # only after all the changes have been applied
+
+    return mirror.read_all()
+
+
+class CursorResetError(Exception):
+    pass
+
+
+def list_folder_changes(access_token, folder_path=None, cursor=None):
+    """
+    Returns (entries, cursor). Lists every entry in the folder (recursively) if `folder_path` is given,
+    otherwise lists the entries that changed since `cursor`.
+    """
+    if cursor:
+        response = _api_request(access_token, "/2/files/list_folder/continue", {"cursor": cursor})
+    else:
+        response = _api_request(access_token, "/2/files/list_folder", {"path": folder_path, "recursive": True})
+
+    entries = response["entries"]
+    while response["has_more"]:
+        response = _api_request(access_token, "/2/files/list_folder/continue", {"cursor": response["cursor"]})
+        entries += response["entries"]
+
+    return entries, response["cursor"]
+
+
+def download_file(access_token, path):
+    headers = {"Authorization": f"Bearer {access_token}", "Dropbox-API-Arg": json.dumps({"path": path})}
+
+    response = http_pool.request("POST", f"{DROPBOX_CONTENT_URL}/2/files/download", headers=headers)
+
+    if response.status != 200:
+        raise Exception(f"Dropbox download of {path} failed with status {response.status}: {response.data[:200]}")
+
+    return response.data
 
+
+def _api_request(access_token, path, body):
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+
+    response = http_pool.request("POST", f"{DROPBOX_API_URL}{path}", headers=headers, body=json.dumps(body))
+
+    if response.status == 409 and b"reset" in response.data:
+        raise CursorResetError(response.data.decode())
     if response.status != 200:
-        raise Exception(f"Dropbox API request failed with status {response.status}: {response.reason}")
+        raise Exception(f"Dropbox API request {path} failed with status {response.status}: {response.data[:200]}")
+
+    return response.json()
+
+
+class Mirror:
+    """
+    Local copy of a Dropbox folder, along with the `list_folder` cursor that it's up-to-date with.
+    - files/: the files, at their paths relative to the Dropbox folder
+    - state.json: the cursor, and the display path (relative) of each file, keyed by its lowercase Dropbox path
+    """
+
+    def __init__(self, dir_path, dropbox_folder_path):
+        self.files_dir = os.path.join(dir_path, "files")
+        self.state_path = os.path.join(dir_path, "state.json")
+        self.folder_path = dropbox_folder_path
+        self.folder_name = os.path.basename(dropbox_folder_path)
 
-    zip_data = response.read()
-    return io.BytesIO(zip_data)
+        self.cursor = None
+        self.files = {}
+
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if state["folder_path"] == dropbox_folder_path:
+                self.cursor = state["cursor"]
+                self.files = state["files"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def clear(self):
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+        self.files = {}
+
+    def write(self, path_lower, path_display, contents):
+        rel_path = path_display[len(self.folder_path) :].lstrip("/")
+        file_path = os.path.join(self.files_dir, rel_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(contents)
+
+        self.files[path_lower] = rel_path
+
+    def remove(self, path_lower):
+        "Removes a file, or all the files in a folder"
+        folder_prefix = path_lower.rstrip("/") + "/"
+        for key in [k for k in self.files if k == path_lower or k.startswith(folder_prefix)]:
+            rel_path = self.files.pop(key)
+            try:
+                os.remove(os.path.join(self.files_dir, rel_path))
+            except FileNotFoundError:
+                pass
+
+    def save(self, cursor):
+        self.cursor = cursor
+        state = {"folder_path": self.folder_path, "cursor": cursor, "files": self.files}
+
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def read_all(self):
+        files = []
+        for rel_path in sorted(self.files.values()):
+            with open(os.path.join(self.files_dir, rel_path), "rb") as f:
+                files.append((f"{self.folder_name}/{rel_path}", f.read()))
+        return files
+
+
+def get_access_token():
+    """
+    Returns a cached access token, if it's still valid. Otherwise requests a new one from Dropbox.
+    """
+    return _token_cache.get()
+
+
+class AccessTokenCache:
+    """
+    Caches the access token until shortly before it expires (based on `expires_in`), e.g. across the invocations
+    of a warm Lambda. Tokens that are close to expiring are refreshed in a background thread, while the current
+    token is still being used. Safe to use from multiple threads, and only one refresh happens at a time.
+    - cache_path: optional file to save the token in, so that it survives a restart of the process.
+    """
+
+    def __init__(self, request_token, cache_path=None):
+        self.request_token = request_token
+        self.cache_path = cache_path
+        self.token = None
+        self.expires_at = 0
+        self.refreshing_in_background = False
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def get(self):
+        with self._lock:
+            time_left = self.expires_at - time.time()
+            if self.token and time_left > TOKEN_EXPIRY_MARGIN:
+                if time_left < TOKEN_BACKGROUND_REFRESH and not self.refreshing_in_background:
+                    self.refreshing_in_background = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                return self.token
+
+            # refresh while holding the lock, so that the other threads wait for this token instead of requesting more
+            return self._refresh()
+
+    def _refresh(self):
+        data = self.request_token()
+        self.token = data["access_token"]
+        self.expires_at = time.time() + data.get("expires_in", 0)
+        self._save()
+        return self.token
+
+    def _refresh_in_background(self):
+        try:
+            data = self.request_token()
+            with self._lock:
+                self.token = data["access_token"]
+                self.expires_at = time.time() + data.get("expires_in", 0)
+                self._save()
+        except Exception as e:
+            print("Background refresh of the Dropbox access token failed:", e)
+        finally:
+            self.refreshing_in_background = False
+
+    def _load(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            self.token, self.expires_at = data["access_token"], data["expires_at"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp_path = self.cache_path + ".tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump({"access_token": self.token, "expires_at": self.expires_at}, f)
+        os.replace(tmp_path, self.cache_path)
 
 
 def refresh_access_token():
     """
     Requests a new access token from Dropbox using the refresh token.
+    Returns the response, e.g. `{"access_token": "...", "expires_in": 14400, ...}`
     """
-    conn = http.client.HTTPSConnection("api.dropbox.com")
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     body = (
         f"grant_type=refresh_token&"
@@ -43,14 +297,15 @@ def refresh_access_token():
         f"client_secret={DROPBOX_APP_SECRET}"
     )
 
-    conn.request("POST", "/oauth2/token", body=body, headers=headers)
-    response = conn.getresponse()
+    response = http_pool.request("POST", f"{DROPBOX_AUTH_URL}/oauth2/token", body=body, headers=headers)
 
     if response.status != 200:
         raise Exception(f"Failed to refresh Dropbox access token: {response.status} {response.reason}")
 
-    data = json.loads(response.read())
-    return data["access_token"]
+    return response.json()
+
+
+_token_cache = AccessTokenCache(refresh_access_token, DROPBOX_TOKEN_CACHE_PATH)
 
 
 def ensure_slashes(path, start=True, end=True):
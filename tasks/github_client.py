@@ -0,0 +1,196 @@
+"""
+A client for the GitHub REST API, shared by the tasks that publish to GitHub. It uses the shared HTTP connection pool,
+and is safe to use from multiple threads.
+- GET responses are cached with their ETag, and sent again with `If-None-Match`. An unchanged response comes back
+  as a 304, which doesn't count against the rate limit.
+- Rate-limited (and 5xx) responses are retried with a jittered backoff, or after `Retry-After` if it's given, as
+  long as the total wait fits in `max_retry_delay`. Longer waits fail fast.
+- Requests are slowed down once the remaining quota of a token runs low, spreading them until the quota resets.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+
+from tasks import http_pool
+
+# can be pointed to a local server for testing
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+
+
+class GitHubClient:
+    """
+    - api_url: the base URL of the API.
+    - max_retries: the number of times to retry a rate-limited or failed (5xx) request.
+    - max_retry_delay: the total number of seconds that a request can wait between its retries. A retry that would
+      wait longer (e.g. until the hourly rate limit resets, or the minute of a secondary rate limit) fails instead,
+      since a Lambda invocation (with its 30 second timeout) can't wait that long.
+    - min_remaining: start pacing the requests of a token once its remaining quota is below this.
+    - max_pace_delay: the maximum delay (seconds) added before each request while pacing.
+    - max_etag_cache_bytes: the total size of the cached GET responses. The least-recently used are evicted.
+    """
+
+    def __init__(
+        self,
+        api_url=GITHUB_API_URL,
+        max_retries=4,
+        max_retry_delay=10,
+        min_remaining=500,
+        max_pace_delay=2,
+        max_etag_cache_bytes=16 * 1024 * 1024,
+    ):
+        self.api_url = api_url
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.min_remaining = min_remaining
+        self.max_pace_delay = max_pace_delay
+        self.max_etag_cache_bytes = max_etag_cache_bytes
+        self.counters = {"requests": 0, "not_modified": 0, "retries": 0, "rate_limited": 0, "paced_seconds": 0.0}
+        self._etags = OrderedDict()  # (token hash, path) -> (etag, response body)
+        self._etag_cache_size = 0
+        self._rate_limits = {}  # token hash -> (remaining, reset time)
+        self._lock = threading.Lock()
+
+    def request(self, method, path, token, body=None):
+        "Sends the request, and returns the parsed JSON response. Raises a RuntimeError if it fails."
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            "User-Agent": "publish-to-github-script",
+        }
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        else:
+            data = None
+
+        token_key = hashlib.sha256(token.encode()).hexdigest() if token else ""
+        etag_key = (token_key, path)  # the response can depend on the permissions of the token
+        cached = None
+        if method == "GET":
+            with self._lock:
+                cached = self._etags.get(etag_key)
+                if cached is not None:
+                    self._etags.move_to_end(etag_key)
+                    headers["If-None-Match"] = cached[0]
+
+        waited = 0
+        for attempt in range(self.max_retries + 1):
+            self._pace(token_key)
+            resp = http_pool.request(method, self.api_url + path, body=data, headers=headers)
+            with self._lock:
+                self.counters["requests"] += 1
+            self._update_rate_limit(token_key, resp)
+
+            delay = self._get_retry_delay(resp, attempt, self.max_retry_delay - waited)
+            if delay is None or attempt == self.max_retries:
+                break
+
+            print(f"GitHub API error {resp.status} for {method} {path}, retrying in {delay:.1f} seconds")
+            with self._lock:
+                self.counters["retries"] += 1
+            time.sleep(delay)
+            waited += delay
+
+        if resp.status == 304 and cached is not None:
+            with self._lock:
+                self.counters["not_modified"] += 1
+            return json.loads(cached[1])
+
+        resp_data = resp.data.decode("utf-8")
+        if resp.status >= 300:
+            raise RuntimeError(f"GitHub API error {resp.status}: {resp_data}")
+
+        etag = resp.headers.get("ETag")
+        if method == "GET" and etag:
+            self._put_etag(etag_key, etag, resp.data)
+
+        if resp_data:
+            return json.loads(resp_data)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, etag_cache_entries=len(self._etags))
+
+    def _pace(self, token_key):
+        "Waits before a request, if the remaining quota of the token is low"
+        with self._lock:
+            remaining, reset = self._rate_limits.get(token_key, (None, None))
+        if remaining is None or remaining >= self.min_remaining:
+            return
+
+        delay = min((reset - time.time()) / max(remaining, 1), self.max_pace_delay)
+        if delay > 0:
+            with self._lock:
+                self.counters["paced_seconds"] += delay
+            time.sleep(delay)
+            waited += delay
+
+    def _update_rate_limit(self, token_key, resp):
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        reset = resp.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._rate_limits[token_key] = (int(remaining), int(reset))
+
+    def _get_retry_delay(self, resp, attempt, budget):
+        """
+        Returns the number of seconds to wait before retrying the request, or None if it shouldn't be retried
+        (including if the wait would be longer than `budget` seconds)
+        """
+        backoff = random.uniform(0.5, 1) * 2**attempt  # jittered, so that parallel requests don't retry together
+
+        if resp.status in (403, 429):
+            # rate limited: https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after) + random.uniform(0, 1)
+            elif resp.headers.get("X-RateLimit-Remaining") == "0":
+                delay = int(resp.headers.get("X-RateLimit-Reset", 0)) - time.time() + 1
+            elif resp.status == 429:
+                delay = backoff
+            elif b"secondary rate limit" in resp.data.lower():
+                # GitHub asks to wait at least a minute, and longer after each retry
+                delay = 60 * 2**attempt + random.uniform(0, 1)
+            else:
+                return None  # e.g. the token doesn't have access to the repo
+
+            with self._lock:
+                self.counters["rate_limited"] += 1
+            delay = max(delay, 0)
+            return delay if delay <= budget else None
+
+        if resp.status >= 500:
+            return backoff if backoff <= budget else None
+        return None
+
+    def _put_etag(self, etag_key, etag, data):
+        if len(data) > self.max_etag_cache_bytes:
+            return
+
+        with self._lock:
+            old = self._etags.pop(etag_key, None)
+            if old is not None:
+                self._etag_cache_size -= len(old[1])
+
+            self._etags[etag_key] = (etag, data)
+            self._etag_cache_size += len(data)
+
+            while self._etag_cache_size > self.max_etag_cache_bytes:
+                _, (_, evicted) = self._etags.popitem(last=False)
+                self._etag_cache_size -= len(evicted)
+
+
+client = GitHubClient()
+
+
+def request(method, path, token, body=None):
+    "Sends the request using the shared client"
+    return client.request(method, path, token, body)
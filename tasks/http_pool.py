@@ -0,0 +1,117 @@
+"""
+A shared pool of keep-alive HTTP connections, for the tasks that call HTTP APIs (Dropbox, GitHub).
+Reusing a connection skips the TCP and TLS handshakes, which are a big part of the time taken by small API calls.
+"""
+
+import json
+import threading
+import http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# errors that mean that the server closed an idle keep-alive connection, before we sent the request on it
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class Response:
+    def __init__(self, status, reason, headers, data):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+    def json(self):
+        return json.loads(self.data) if self.data else None
+
+
+class ConnectionPool:
+    """
+    Keeps idle connections per (scheme, host), and hands them out to one request at a time.
+    Safe to use from multiple threads.
+    - max_idle_per_host: the number of idle connections to keep open for each host.
+    - timeout: socket timeout (seconds) for new connections.
+    """
+
+    def __init__(self, max_idle_per_host=8, timeout=60):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}  # (scheme, netloc) -> list of connections
+        self._lock = threading.Lock()
+
+    def request(self, method, url, body=None, headers=None):
+        "Sends the request, and returns a `Response` with the full response body"
+        with self.stream(method, url, body, headers) as response:
+            data = response.read()
+            return Response(response.status, response.reason, response.headers, data)
+
+    @contextmanager
+    def stream(self, method, url, body=None, headers=None):
+        """
+        Sends the request, and yields the `http.client.HTTPResponse`, so that a large response body can be read
+        in chunks. The connection goes back to the pool only if the body was read completely.
+        """
+        url = urlsplit(url)
+        key = (url.scheme, url.netloc)
+        path = url.path + (f"?{url.query}" if url.query else "")
+
+        conn, is_reused = self._get_connection(key)
+        try:
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not is_reused:
+                    raise
+                conn.close()  # the server closed it while it was idle, try once more on a new connection
+                conn, is_reused = self._get_connection(key, reuse=False)
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+
+        if response.isclosed() and not response.will_close:
+            self._release(key, conn)
+        else:
+            conn.close()
+
+    def stats(self):
+        return {"opened": self.opened, "reused": self.reused}
+
+    def _get_connection(self, key, reuse=True):
+        with self._lock:
+            idle = self._idle.get(key)
+            if reuse and idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+
+        scheme, netloc = key
+        if scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+pool = ConnectionPool()
+
+
+def request(method, url, body=None, headers=None):
+    "Sends the request using the shared connection pool"
+    return pool.request(method, url, body, headers)
+
+
+def stream(method, url, body=None, headers=None):
+    "Sends the request using the shared connection pool, and yields the response to read in chunks"
+    return pool.stream(method, url, body, headers)
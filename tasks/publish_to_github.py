@@ -1,83 +1,108 @@
-import http.client
 import json
 import hashlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from tasks import github_client
+
+MAX_PARALLEL_UPLOADS = 8
+# small files are sent inline in the tree request, instead of one request per blob
+MAX_INLINE_FILE_SIZE = 256 * 1024
+MAX_INLINE_TREE_SIZE = 4 * 1024 * 1024  # the total size of the inline files in a tree request
 
 
 def run(files, owner, repo, branch, token, **kwargs):
     """
     Commit only changed files to a GitHub repo branch using the Git Data API.
 
+    Small files are sent inline in the tree request, so a typical publish takes a constant number of requests
+    (ref, tree, commit and ref update). Bigger files are uploaded as blobs first, in parallel. The branch is
+    updated only if it's still at the commit that the new commit is based on (i.e. a fast-forward).
+
     Args:
         files: list of tuples (filepath, file_contents)
             filepath: str - path inside the repo (e.g. "posts/new.md")
-            file_contents: str - file contents as text (UTF-8)
+            file_contents: str - file contents as text (UTF-8), or None to delete the file
         owner: str
         repo: str
         branch: str
         token: str (PAT or GitHub App installation token)
         prefix: optional str, prefix path inside repo
+        tree_cache: optional liteflow store for the files of the branch at each commit, to skip fetching the tree
+            if the branch hasn't changed since the last run.
     """
     prefix = kwargs.get("prefix", "")
+    tree_cache = kwargs.get("tree_cache")
     if prefix:
         prefix = prefix.strip("/")
 
     api_base = f"/repos/{owner}/{repo}"
 
     # 1. Get the latest commit on the branch
-    ref_data = _gh_request("GET", f"{api_base}/git/ref/heads/{branch}", token)
+    ref_data = github_client.request("GET", f"{api_base}/git/ref/heads/{branch}", token)
     latest_commit_sha = ref_data["object"]["sha"]
 
-    commit_data = _gh_request("GET", f"{api_base}/git/commits/{latest_commit_sha}", token)
-    base_tree_sha = commit_data["tree"]["sha"]
+    # 2. Get the files under the prefix, unless they're cached for this commit
+    tree_state = _get_cached_tree(tree_cache, owner, repo, branch, prefix, latest_commit_sha)
+    if tree_state is None:
+        commit_data = github_client.request("GET", f"{api_base}/git/commits/{latest_commit_sha}", token)
+        base_tree_sha = commit_data["tree"]["sha"]
 
-    # 2. Get the full tree of the branch
-    tree_data = _gh_request("GET", f"{api_base}/git/trees/{base_tree_sha}?recursive=1", token)
-    existing_files = {item["path"]: item["sha"] for item in tree_data.get("tree", []) if item["type"] == "blob"}
+        existing_files = _get_files(api_base, token, base_tree_sha, prefix)
 
-    # 3. Prepare tree entries for changed files only
-    tree_entries = []
-    changed_files = []
+        tree_state = {"tree": base_tree_sha, "files": existing_files}
+        _put_cached_tree(tree_cache, owner, repo, branch, prefix, latest_commit_sha, tree_state)
+
+    base_tree_sha = tree_state["tree"]
+    existing_files = tree_state["files"]
+
+    # 3. Find the changed files (content None means that the file is deleted)
+    changes = []  # tuples of (full_path, content, blob_sha, size)
 
     for filepath, content in files:
         full_path = f"{prefix}/{filepath}" if prefix else filepath
 
+        if content is None:
+            if full_path in existing_files:
+                print(f"File deleted: {full_path}")
+                changes.append((full_path, None, None, 0))
+            continue
+
         # Quick check: if file exists and has the same blob sha, skip
-        computed_sha = None
-        if full_path in existing_files:
-            content_encoded = content.encode("utf-8")
-            data = f"blob {len(content_encoded)}\0".encode("utf-8")
-            data += content_encoded
-            computed_sha = hashlib.sha1(data).hexdigest()
-            if computed_sha == existing_files[full_path]:
-                continue  # unchanged
+        content_encoded = content.encode("utf-8")
+        computed_sha = _get_blob_sha(content_encoded)
+        if existing_files.get(full_path) == computed_sha:
+            continue  # unchanged
 
         print(f"File changed: {full_path}. Old SHA: {existing_files.get(full_path, 'None')}, New SHA: {computed_sha}")
+        changes.append((full_path, content, computed_sha, len(content_encoded)))
 
-        # Create new blob
-        blob_resp = _gh_request(
-            "POST",
-            f"{api_base}/git/blobs",
-            token,
-            {"content": content, "encoding": "utf-8"},
-        )
-        blob_sha = blob_resp["sha"]
-
-        tree_entries.append(
-            {
-                "path": full_path,
-                "mode": "100644",
-                "type": "blob",
-                "sha": blob_sha,
-            }
-        )
-        changed_files.append(full_path)
-
-    if not tree_entries:
+    if not changes:
         print("No files changed, nothing to commit.")
         return []
 
+    # Upload the files that are too big to send inline in parallel, and add all the files to the tree
+    # in the same order as the input files
+    inline_paths = _get_inline_paths(changes)
+    uploads = [(path, content) for path, content, _, _ in changes if content is not None and path not in inline_paths]
+    blob_shas = _create_blobs(api_base, token, [content for _, content in uploads])
+    blob_shas = dict(zip([full_path for full_path, _ in uploads], blob_shas))
+
+    tree_entries = []
+    changed_files = []
+    new_files = {}
+    for full_path, content, computed_sha, _ in changes:
+        entry = {"path": full_path, "mode": "100644", "type": "blob"}
+        if full_path in inline_paths:
+            entry["content"] = content
+        else:
+            entry["sha"] = blob_shas.get(full_path)
+        tree_entries.append(entry)
+        changed_files.append(full_path)
+        new_files[full_path] = computed_sha
+
     # 4. Create a new tree
-    new_tree_resp = _gh_request(
+    new_tree_resp = github_client.request(
         "POST",
         f"{api_base}/git/trees",
         token,
@@ -86,7 +111,7 @@ def run(files, owner, repo, branch, token, **kwargs):
     new_tree_sha = new_tree_resp["sha"]
 
     # 5. Create a new commit
-    new_commit_resp = _gh_request(
+    new_commit_resp = github_client.request(
         "POST",
         f"{api_base}/git/commits",
         token,
@@ -99,36 +124,108 @@ def run(files, owner, repo, branch, token, **kwargs):
     new_commit_sha = new_commit_resp["sha"]
 
     # 6. Update the branch ref
-    _gh_request(
+    github_client.request(
         "PATCH",
         f"{api_base}/git/refs/heads/{branch}",
         token,
-        {"sha": new_commit_sha},
+        {"sha": new_commit_sha, "force": False},
     )
 
     print(f"Committed {changed_files} to {owner}/{repo}@{branch}. Commit SHA: {new_commit_sha}")
+
+    # 7. Cache the files of the new commit, so that the next run doesn't need to fetch its tree
+    for full_path, blob_sha in new_files.items():
+        if blob_sha is None:
+            existing_files.pop(full_path, None)
+        else:
+            existing_files[full_path] = blob_sha
+    tree_state = {"tree": new_tree_sha, "files": existing_files}
+    _put_cached_tree(tree_cache, owner, repo, branch, prefix, new_commit_sha, tree_state)
+
     return []
 
 
-def _gh_request(method, path, token, body=None):
-    conn = http.client.HTTPSConnection("api.github.com")
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28",
-        "User-Agent": "publish-to-github-script",
-    }
-    if body is not None:
-        data = json.dumps(body).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-    else:
-        data = None
-
-    conn.request(method, path, body=data, headers=headers)
-    resp = conn.getresponse()
-    resp_data = resp.read().decode("utf-8")
-    if resp.status >= 300:
-        raise RuntimeError(f"GitHub API error {resp.status}: {resp_data}")
-    if resp_data:
-        return json.loads(resp_data)
-    return None
+def _get_files(api_base, token, tree_sha, prefix):
+    """
+    Returns a dict of path -> blob SHA for the files under `prefix`. Only the trees along the prefix and the
+    subtree of the prefix are fetched, instead of the entire repo (e.g. with all the theme files and images).
+    """
+    for name in prefix.split("/") if prefix else []:
+        tree_data = github_client.request("GET", f"{api_base}/git/trees/{tree_sha}", token)
+        subtrees = {item["path"]: item["sha"] for item in tree_data["tree"] if item["type"] == "tree"}
+        if name not in subtrees:
+            return {}  # the prefix doesn't exist yet
+        tree_sha = subtrees[name]
+
+    files = {}
+    _list_files(api_base, token, tree_sha, prefix, files)
+    return files
+
+
+def _list_files(api_base, token, tree_sha, dir_path, files):
+    """
+    Adds the files in a tree (and its subtrees) to `files`. GitHub truncates big recursive listings, in which
+    case each subtree is listed separately.
+    """
+    tree_data = github_client.request("GET", f"{api_base}/git/trees/{tree_sha}?recursive=1", token)
+    is_recursive = not tree_data.get("truncated")
+    if not is_recursive:
+        tree_data = github_client.request("GET", f"{api_base}/git/trees/{tree_sha}", token)
+
+    for item in tree_data["tree"]:
+        path = f"{dir_path}/{item['path']}" if dir_path else item["path"]
+        if item["type"] == "blob":
+            files[path] = item["sha"]
+        elif item["type"] == "tree" and not is_recursive:
+            _list_files(api_base, token, item["sha"], path, files)
+
+
+def _get_cached_tree(tree_cache, owner, repo, branch, prefix, commit_sha):
+    if tree_cache is None:
+        return None
+    data = tree_cache.get(_get_tree_cache_key(owner, repo, branch, prefix, commit_sha))
+    return json.loads(data) if data is not None else None
+
+
+def _put_cached_tree(tree_cache, owner, repo, branch, prefix, commit_sha, tree_state):
+    if tree_cache is not None:
+        key = _get_tree_cache_key(owner, repo, branch, prefix, commit_sha)
+        tree_cache.put(key, json.dumps(tree_state).encode())
+
+
+def _get_tree_cache_key(owner, repo, branch, prefix, commit_sha):
+    return hashlib.sha256(f"github-tree:{owner}/{repo}@{branch}:{prefix}:{commit_sha}".encode()).hexdigest()
+
+
+def _get_blob_sha(data: bytes) -> str:
+    "Returns the SHA that git uses for a blob with this content"
+    return hashlib.sha1(f"blob {len(data)}\0".encode("utf-8") + data).hexdigest()
+
+
+def _get_inline_paths(changes):
+    "Returns the paths of the changed files that are small enough to send inline in the tree request"
+    inline_paths = set()
+    total_size = 0
+    for full_path, content, _, size in changes:
+        if content is not None and size <= MAX_INLINE_FILE_SIZE and total_size + size <= MAX_INLINE_TREE_SIZE:
+            inline_paths.add(full_path)
+            total_size += size
+    return inline_paths
+
+
+def _create_blobs(api_base, token, contents):
+    "Returns the list of blob SHAs, in the same order as `contents`"
+    if not contents:
+        return []
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_UPLOADS) as executor:
+        try:
+            return list(executor.map(partial(_create_blob, api_base, token), contents))
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def _create_blob(api_base, token, content):
+    blob_resp = github_client.request("POST", f"{api_base}/git/blobs", token, {"content": content, "encoding": "utf-8"})
+    return blob_resp["sha"]
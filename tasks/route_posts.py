@@ -0,0 +1,90 @@
+import inspect
+
+
+class Router:
+    """
+    Sends each post to the targets whose rules it matches, in a single pass over the posts. The rules are
+    compiled into a tag -> project index and a tag -> excluded targets index, so the cost per post depends
+    only on the number of its tags, not on the number of targets.
+
+    Use it as `[router.run, {(router.target("blog"), ...), (router.target("other-blog"), ...)}]`. When the posts are
+    streamed, liteflow sends each target's branch only the posts of that target (see `TargetSelector.accepts()`).
+    - project_tags: dict of project -> list of tags, in order of precedence. `post.project` is set to the first
+      project that has any of the post's tags (or None).
+    - routes: dict of target -> rule. A rule can have:
+        - "project": only send the posts of this project. By default, all the posts are sent.
+        - "exclude_tags": list of tags. Skip the posts that have any of these tags.
+    """
+
+    def __init__(self, project_tags, routes):
+        self.routes = routes
+
+        self.project_of_tag = {}  # tag -> (precedence, project)
+        for precedence, (project, tags) in enumerate(project_tags.items()):
+            for tag in tags:
+                self.project_of_tag.setdefault(tag, (precedence, project))
+
+        self.targets_of_project = {}  # project (or None) -> frozenset of targets
+        for project in (None, *project_tags):
+            self.targets_of_project[project] = frozenset(
+                target for target, rule in routes.items() if rule.get("project", project) == project
+            )
+
+        self.excluded_targets_of_tag = {}  # tag -> frozenset of targets
+        for target, rule in routes.items():
+            for tag in rule.get("exclude_tags", []):
+                self.excluded_targets_of_tag[tag] = self.excluded_targets_of_tag.get(tag, frozenset()) | {target}
+
+    def run(self, files, **kwargs):
+        """
+        Returns a dict of target -> list of (key, Post) tuples. If `files` is a generator (i.e. the posts are
+        streamed), yields a (targets, (key, Post)) tuple for each post instead, as soon as it's routed.
+        """
+        if inspect.isgenerator(files):
+            return self._route_stream(files)
+
+        routed = {target: [] for target in self.routes}
+        for entry in files:
+            for target in self._get_targets(entry[1]):
+                routed[target].append(entry)
+        return routed
+
+    def target(self, name):
+        "Returns a task that selects the posts of a target, from the output of `run()`"
+        if name not in self.routes:
+            raise ValueError(f"Unknown target: {name}")
+        return TargetSelector(name)
+
+    def _route_stream(self, files):
+        for entry in files:
+            yield self._get_targets(entry[1]), entry
+
+    def _get_targets(self, post):
+        "Sets the project of the post, and returns the set of targets that it's sent to"
+        project_of_tag = self.project_of_tag
+        excluded_targets_of_tag = self.excluded_targets_of_tag
+
+        project = min((project_of_tag[tag] for tag in post.tags if tag in project_of_tag), default=None)
+        post.project = project and project[1]
+
+        targets = self.targets_of_project[post.project]
+        for tag in post.tags:
+            if tag in excluded_targets_of_tag:
+                targets = targets - excluded_targets_of_tag[tag]
+        return targets
+
+
+class TargetSelector:
+    "Selects the posts of a target, from the output of `Router.run()`"
+
+    def __init__(self, target):
+        self.target = target
+
+    def accepts(self, routed_post):
+        "Used by liteflow to send only the posts of this target to its branch, when the posts are streamed"
+        return self.target in routed_post[0]
+
+    def run(self, routed, **kwargs):
+        if isinstance(routed, dict):
+            return routed[self.target]
+        return (entry for targets, entry in routed if self.target in targets)
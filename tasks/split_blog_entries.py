@@ -1,27 +1,80 @@
 import os
 import re
+import pickle
+import hashlib
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
+PARSER_VERSION = 3  # change this when the parsing logic (or Post) changes, to ignore the cached parses
 
-@dataclass
+
+@dataclass(slots=True)
 class Post:
     id: str
     time: datetime
     tags: list
     body: str
     title: str = None
+    project: str = None
+    # text to add before and after the body. Use `dataclasses.replace(post, prefix=...)` to change them,
+    # so that the copies of a post (e.g. in different branches of the workflow) share the same body string.
+    prefix: tuple = ()
+    suffix: tuple = ()
+    source: str = field(default=None, compare=False)  # the journal file that the post was parsed from
+    fingerprint: str = field(default=None, compare=False)  # a hash of the post's text in the journal
+
+    def render_body(self) -> str:
+        "Returns the body, along with the prefix and suffix"
+        if not self.prefix and not self.suffix:
+            return self.body
+        return "".join((*self.prefix, self.body, *self.suffix))
+
+    def __reduce__(self):
+        # pickle the field values as a tuple, which is smaller and faster (e.g. for process pools)
+        fields = (self.id, self.time, self.tags, self.body, self.title, self.project, self.prefix, self.suffix)
+        return (Post, fields + (self.source, self.fingerprint))
+
+
+def run(files, cache=None, **kwargs):
+    """
+    Yields tuples of (filename, Post), as each file is parsed.
+    - cache: optional liteflow store for the parsed posts of each file, keyed by a hash of the file's name and contents.
+    """
 
+    for filename, file_contents in files:
+        if cache is None:
+            yield from process_file(filename, file_contents)
+            continue
 
-def run(files, **kwargs):
-    "Returns a list of tuples. Each tuple is (filename, Post)"
+        key = get_cache_key(filename, file_contents)
+        cached_posts = cache.get(key)
+        if cached_posts is not None:
+            yield from pickle.loads(cached_posts)
+            continue
 
-    new_files = []
+        posts = process_file(filename, file_contents)
+        cache.put(key, pickle.dumps(posts, protocol=pickle.HIGHEST_PROTOCOL))
+        yield from posts
 
-    for filename, file_contents in files:
-        new_files += process_file(filename, file_contents)
 
-    return new_files
+def get_cache_key(filename: str, file_contents: bytes) -> str:
+    h = hashlib.sha256(f"split_blog_entries:{PARSER_VERSION}:{filename}\0".encode())
+    h.update(file_contents)
+    return h.hexdigest()
+
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_NUMBERS = {name: i + 1 for i, name in enumerate(MONTHS)}
+
+POST_SEPARATOR = re.compile(r"\n\s*--\s*\n")
+TAG_LINE = re.compile(r"#\S")  # '#' immediately followed by non-space text
+# line breaks (other than "\n") that `str.splitlines()` splits on
+OTHER_LINE_BREAKS = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+# the date format used in the journal, e.g. "Mon Jan 01 09:30:00 2024". Anything else is parsed by `strptime`.
+POST_DATE = re.compile(
+    r"(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) ([A-Z][a-z]{2}) ([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2}) ([0-9]{4})"
+)
+POST_DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
 
 
 def process_file(filename: str, file_contents: bytes) -> list:
@@ -36,65 +89,76 @@ def process_file(filename: str, file_contents: bytes) -> list:
 
     # Extract month and year from the filename
     month_name, year = name.split(" ")
-    month_int = f"{['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'].index(month_name[:3]) + 1:02}"
+    month_int = f"{MONTHS.index(month_name[:3]) + 1:02}"
+    key_prefix = f"{dir_path}/{year}/{month_int}/"
 
-    # Split file contents into posts
-    posts = re.split(r"\n\s*--\s*\n", file_contents.strip())
-
-    # Create list for posts
     post_list = []
-    for i, post in enumerate(posts):
+    for post in POST_SEPARATOR.split(file_contents.strip()):
         post = post.strip()
         if post:
             data = process_post(post)
-            key = f"{dir_path}/{year}/{month_int}/{data.id}"
-            post_list.append((key, data))
+            data.source = filename
+            post_list.append((key_prefix + data.id, data))
 
     return post_list
 
 
 def process_post(post_contents: str) -> Post:
-    # Split post contents into lines
-    lines = post_contents.strip().splitlines()
-
-    # Extract date and initialize variables
-    post_date = lines[0]
-    tags = []
-
-    post_time = datetime.strptime(post_date, "%a %b %d %H:%M:%S %Y")
+    """
+    Parses a post in a single pass: the header lines (date, tags, title and slug) are read one at a time,
+    and everything after them is the body.
+    """
+    post = post_contents.strip()
+    if any(c in post for c in OTHER_LINE_BREAKS):  # faster than a regex, since each `in` is a memchr
+        post = "\n".join(post.splitlines())  # e.g. "\r\n", so that the rest of the parser only needs to handle "\n"
+
+    end = post.find("\n")
+    if end == -1:
+        end = len(post)
+
+    post_time = parse_date(post[:end])
     post_id = str(int(post_time.timestamp()))
-
-    # Initialize variables
     tags = []
     title = None
 
     # Parse lines for tags and title
-    idx = 1
-    while idx < len(lines):
-        line = lines[idx].strip()
+    start = end + 1
+    while start < len(post):
+        end = post.find("\n", start)
+        if end == -1:
+            end = len(post)
+
+        line = post[start:end].strip()
         if not line:
-            idx += 1
-            continue
-        # Only accept lines that start with '#' immediately followed by non-space text
-        if re.match(r"^#\S+", line):
-            tags += [tag for tag in line.split()]
-            idx += 1
+            start = end + 1
             continue
-        if line.lower().startswith("title: "):
-            title = line[len("title: ") :].strip()
-            idx += 1
-            continue
-        if line.lower().startswith("slug: "):
-            post_id = line[len("slug: ") :].strip()
-            idx += 1
-            continue
-        # First non-tag/title/slug line is the start of the body
-        break
+        if TAG_LINE.match(line):
+            tags += line.split()
+        elif line[:7].lower() == "title: ":
+            title = line[7:].strip()
+        elif line[:6].lower() == "slug: ":
+            post_id = line[6:].strip()
+        else:
+            break  # First non-tag/title/slug line is the start of the body
+        start = end + 1
 
     # Remaining lines are the post body
-    post_body = "\n".join(lines[idx:]).strip()
+    post_body = post[start:].strip()
 
     if title:
         post_body = f"# {title}\n\n{post_body}"
 
-    return Post(post_id, post_time, tags, post_body, title)
+    fingerprint = hashlib.sha256(post.encode()).hexdigest()
+    return Post(post_id, post_time, tags, post_body, title, fingerprint=fingerprint)
+
+
+def parse_date(post_date: str) -> datetime:
+    m = POST_DATE.fullmatch(post_date)
+    month = m and MONTH_NUMBERS.get(m[1])
+    if month:
+        try:
+            return datetime(int(m[6]), month, int(m[2]), int(m[3]), int(m[4]), int(m[5]))
+        except ValueError:
+            pass  # let strptime raise its usual error
+
+    return datetime.strptime(post_date, POST_DATE_FORMAT)
@@ -0,0 +1,128 @@
+"""
+Tracks the posts that were published to each target, so that only the posts that were added, modified or
+deleted since the last successful run are rendered and published.
+"""
+
+import json
+import hashlib
+
+
+class ChangeTracker:
+    """
+    Records the journal files that are read in this run, and keeps a `ChangeIndex` for each target.
+    Posts that aren't in their file anymore (or whose file was removed) are deleted from the targets, but only
+    if the file was read in this run, or doesn't exist anymore.
+    - store: a liteflow store, e.g. `DiskStore`.
+    - existing_files: optional collection of all the files that exist, if unchanged files are skipped without
+      being read (e.g. `Manifest.current`). By default, every file that exists is expected to be read.
+    - version: change this to publish all the posts again (e.g. when the output format changes). Use the same
+      version for the `Manifest`, so that the skipped files are read again too.
+    """
+
+    def __init__(self, store, existing_files=None, version=None):
+        self.store = store
+        self.existing_files = existing_files
+        self.version = version
+        self.read_files = set()
+        self.indexes = {}
+
+    def track_files(self, files):
+        "Yields the (filename, contents) tuples unchanged, while recording the filenames"
+        for entry in files:
+            self.read_files.add(entry[0])
+            yield entry
+
+    def is_stale(self, filename):
+        "Returns True if the posts of this file that weren't seen in this run have been deleted"
+        existing_files = self.read_files if self.existing_files is None else self.existing_files
+        return filename in self.read_files or filename not in existing_files
+
+    def index(self, key, get_path):
+        "Returns the `ChangeIndex` of a target"
+        if key not in self.indexes:
+            self.indexes[key] = ChangeIndex(self.store, key, self, get_path, self.version)
+        return self.indexes[key]
+
+    def save(self):
+        for index in self.indexes.values():
+            index.save()
+
+
+class ChangeIndex:
+    """
+    The fingerprint, output path and source file of each post that was published to a target, as of the last
+    successful run. Add `select` before the render step, and `add_deletions` after it. Call `save()` once the
+    rest of the workflow has succeeded, so that posts that failed to publish are processed again in the next run.
+    - store: a liteflow store.
+    - key: the name of the target, e.g. "cmdr2.github.io".
+    - tracker: the `ChangeTracker` of this run.
+    - get_path: function that receives a post, and returns the path that it's rendered to.
+    - version: change this to render all the posts again (e.g. when the output format changes). The outputs
+      of the older version are still deleted if they aren't produced anymore.
+    """
+
+    def __init__(self, store, key, tracker, get_path, version=None):
+        self.store = store
+        self.key = key
+        self.tracker = tracker
+        self.get_path = get_path
+        self.version = version
+        self.previous = {}  # post key -> [fingerprint, path, source filename]
+        self.seen = set()
+
+        data = store.get(key)
+        if data is not None:
+            data = json.loads(data)
+            if data.get("version") == version:
+                self.previous = data["posts"]
+            else:  # forget the fingerprints, but keep the paths of the outputs
+                self.previous = {key: [None, path, source] for key, (_, path, source) in data["posts"].items()}
+        self.current = dict(self.previous)
+
+    def select(self, files):
+        "Yields only the (key, Post) tuples that were added or modified since the last run"
+        for entry in files:
+            key, post = entry
+            self.seen.add(key)
+
+            fingerprint = get_fingerprint(post)
+            old = self.previous.get(key)
+            if old and old[0] == fingerprint:
+                continue
+
+            self.current[key] = [fingerprint, self.get_path(post), post.source]
+            yield entry
+
+    def add_deletions(self, files):
+        """
+        Yields the rendered (path, contents) tuples unchanged, followed by (path, None) for each output
+        that should be deleted (e.g. a deleted post, or the old path of a post whose slug was changed).
+        """
+        yield from files
+
+        deleted = []
+        for key, (_, path, source) in self.previous.items():
+            if key in self.seen:
+                if self.current[key][1] != path:
+                    deleted.append(path)
+            elif source is not None and self.tracker.is_stale(source):
+                del self.current[key]
+                deleted.append(path)
+
+        paths = {entry[1] for entry in self.current.values()}
+        for path in deleted:
+            if path not in paths:
+                yield path, None
+
+    def save(self):
+        data = {"version": self.version, "posts": self.current}
+        self.store.put(self.key, json.dumps(data).encode())
+
+
+def get_fingerprint(post) -> str:
+    "Returns a hash of everything in the post that affects its rendered output"
+    content_hash = post.fingerprint or repr((post.id, post.time, post.tags, post.body, post.title))
+    h = hashlib.sha256(content_hash.encode())
+    for part in (post.project or "", *post.prefix, "\0", *post.suffix):
+        h.update(b"\0" + part.encode())
+    return h.hexdigest()
@@ -1,14 +1,107 @@
+import os
+import json
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
+LARGE_FILE_SIZE = 1024 * 1024  # files bigger than this are decompressed in parallel threads
 
-def run(data, **kwargs):
-    unzipped_files = []  # tuple of (filename, contents)
+
+def run(data, extensions=None, include=None, max_workers=4, manifest=None, **kwargs):
+    """
+    Yields tuples of (filename, contents). Each file is read from the zip only when it's needed.
+    - extensions: optional list of file extensions to include, e.g. [".txt"].
+    - include: optional function that receives a filename, and returns True if the file should be included.
+    - max_workers: the number of threads used to decompress large files in parallel (zlib releases the GIL).
+    - manifest: optional `Manifest` from the previous run. Only the files that changed since then are yielded.
+
+    The filters are applied using the zip's central directory, so the files that are skipped are never
+    decompressed. Directories are always skipped.
+    """
+    if extensions:
+        extensions = tuple(ext.lower() for ext in extensions)
 
     with zipfile.ZipFile(data, "r") as zip_ref:
-        for file_info in zip_ref.infolist():
-            file_name = file_info.filename
+        file_infos = [info for info in zip_ref.infolist() if _is_included(info, extensions, include)]
+        if manifest is not None:
+            file_infos = [info for info in file_infos if not manifest.is_clean(info)]
+
+        if max_workers <= 1 or not any(info.file_size >= LARGE_FILE_SIZE for info in file_infos):
+            for file_info in file_infos:
+                yield file_info.filename, _read(zip_ref, file_info)
+            return
+
+        # read ahead by a few files, decompressing the large ones in threads, and yield them in the original order
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for file_info in file_infos:
+                if file_info.file_size >= LARGE_FILE_SIZE:
+                    pending.append((file_info.filename, executor.submit(_read, zip_ref, file_info)))
+                else:
+                    pending.append((file_info.filename, _read(zip_ref, file_info)))
+
+                if len(pending) > max_workers:
+                    yield _result(*pending.popleft())
+
+            while pending:
+                yield _result(*pending.popleft())
+
+
+class Manifest:
+    """
+    The CRC32 and size of every file in the zip, as of the last successful run. Files whose entry in the
+    zip's central directory hasn't changed since then are marked as clean (in `clean`), without decompressing them.
+
+    Call `save()` once the rest of the workflow has succeeded, so that files that failed to publish are
+    processed again in the next run.
+    - store: a liteflow store, e.g. `DiskStore`.
+    - version: change this to ignore manifests saved by older code (e.g. when the output format changes).
+    """
+
+    def __init__(self, store, key="unzip-manifest", version=None):
+        self.store = store
+        self.key = key
+        self.version = version
+        self.previous = {}  # filename -> [crc32, size]
+        self.current = {}
+        self.clean = set()
+
+        data = store.get(key)
+        if data is not None:
+            data = json.loads(data)
+            if data.get("version") == version:
+                self.previous = data["files"]
+
+    def is_clean(self, file_info):
+        entry = [file_info.CRC, file_info.file_size]
+        self.current[file_info.filename] = entry
+
+        if self.previous.get(file_info.filename) == entry:
+            self.clean.add(file_info.filename)
+            return True
+        return False
+
+    def save(self):
+        data = {"version": self.version, "files": self.current}
+        self.store.put(self.key, json.dumps(data).encode())
+
+
+def _is_included(file_info, extensions, include):
+    if file_info.is_dir():
+        return False
+    if extensions and os.path.splitext(file_info.filename)[1].lower() not in extensions:
+        return False
+    if include and not include(file_info.filename):
+        return False
+    return True
+
+
+def _read(zip_ref, file_info):
+    with zip_ref.open(file_info) as file:
+        return file.read()
 
-            with zip_ref.open(file_info) as file:
-                unzipped_files.append((file_name, file.read()))
 
-    return unzipped_files
+def _result(file_name, contents):
+    if isinstance(contents, Future):
+        contents = contents.result()
+    return file_name, contents
@@ -1,6 +1,7 @@
 import os
-import threading
+import hashlib
 from mimetypes import guess_type
+from concurrent.futures import ThreadPoolExecutor
 
 
 S3_BUCKET = os.environ.get("S3_BUCKET")  # "your-s3-bucket-name"
@@ -8,6 +9,8 @@ S3_PREFIX = os.environ.get("S3_PREFIX", "")  # "public/path/in/s3/"
 
 S3_PREFIX = S3_PREFIX.strip("/")
 
+MAX_PARALLEL_UPLOADS = 8
+
 s3_client = None
 if "IS_LOCAL_TEST" not in os.environ:
     import boto3
@@ -17,45 +20,88 @@ if "IS_LOCAL_TEST" not in os.environ:
 
 def run(files, bucket, prefix="", **kwargs):
     """
-    Uploads all files to S3 in a batch operation using threading for concurrent uploads.
-    - files: A list of tuples - (file path, file contents)
+    Uploads the files that changed to S3, using a pool of threads. The ETags of the existing objects are listed
+    once, and files whose MD5 matches the ETag of their object are skipped. Returns a report of the uploads.
+    - files: A list of tuples - (file path, file contents). The contents can be str or bytes, or None to delete
+      the object.
+    - client: optional boto3 S3 client, e.g. one created with an `endpoint_url` for S3-compatible stores, or for
+      testing with moto.
+    - max_workers: the number of parallel uploads.
+
+    Raises an Exception if any upload failed, after the other uploads have finished.
     """
 
     bucket = bucket or S3_BUCKET
-    prefix = prefix or S3_PREFIX
+    prefix = (prefix or S3_PREFIX).strip("/")
+    client = kwargs.get("client") or s3_client
+    max_workers = kwargs.get("max_workers", MAX_PARALLEL_UPLOADS)
 
     if not bucket:
         print("Error: No S3 bucket configured!")
         return
 
-    threads = []
+    remote_etags = list_etags(client, bucket, prefix)
 
+    uploads = []
+    unchanged = []
     for path, content in files:
-        t = threading.Thread(target=upload_file, args=(path, content, bucket, prefix))
-        t.start()
-        threads.append(t)
+        key = prefix + "/" + path if prefix else path
+        if content is None:
+            if key in remote_etags:
+                uploads.append((path, key, None))
+            continue
+
+        if isinstance(content, str):
+            content = content.encode()
+        # the ETag of an object is the MD5 of its content (unless it was uploaded in parts, or encrypted with KMS)
+        if remote_etags.get(key) == hashlib.md5(content).hexdigest():
+            unchanged.append(path)
+        else:
+            uploads.append((path, key, content))
+
+    report = {"uploaded": [], "deleted": [], "unchanged": len(unchanged), "failed": {}}
+    if uploads:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(upload_file, client, bucket, key, content) for _, key, content in uploads]
+            for (path, _, content), future in zip(uploads, futures):
+                try:
+                    future.result()
+                    report["uploaded" if content is not None else "deleted"].append(path)
+                except Exception as e:
+                    report["failed"][path] = repr(e)
+
+    print(
+        f"S3 upload: {len(report['uploaded'])} uploaded, {len(report['deleted'])} deleted, "
+        f"{report['unchanged']} unchanged, {len(report['failed'])} failed"
+    )
+    if report["failed"]:
+        raise Exception(f"Failed to upload {len(report['failed'])} files to S3: {report['failed']}")
+
+    return report
 
-    if kwargs.get("wait_for_uploads", False):
-        for t in threads:
-            t.join()
 
-    return threads
+def list_etags(client, bucket, prefix):
+    "Returns a dict of key -> ETag (without quotes) for the objects under the prefix"
+    etags = {}
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix + "/" if prefix else ""):
+        for obj in page.get("Contents", []):
+            etags[obj["Key"]] = obj["ETag"].strip('"')
+    return etags
 
 
-def upload_file(file_path, file_content, bucket, prefix):
+def upload_file(client, bucket, key, file_content):
     """
-    Upload a single file to S3.
+    Upload a single file to S3 (or delete it, if the content is None).
     """
-    mime_type = guess_type(file_path)[0]
+    if file_content is None:
+        print(f"deleting {key}")
+        client.delete_object(Bucket=bucket, Key=key)
+        return
 
-    key = prefix + "/" + file_path if prefix else file_path
+    mime_type = guess_type(key)[0]
+    extra_args = {"ContentType": mime_type} if mime_type else {}
 
-    print("uploading", key, mime_type)
-    s3_client.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=file_content.encode(),
-        ContentType=mime_type,
-        ACL="public-read",
-    )
-    print("uploaded", file_path)
+    print(f"uploading {key} {mime_type}")
+    client.put_object(Bucket=bucket, Key=key, Body=file_content, ACL="public-read", **extra_args)
+    print(f"uploaded {key}")
@@ -1,6 +1,9 @@
 import os
+import tempfile
+from types import SimpleNamespace
 
-os.environ.update({"IS_LOCAL_TEST": "1"})
+# a new state dir for each run, so that all the posts are published (instead of only the changed ones)
+os.environ.update({"IS_LOCAL_TEST": "1", "STATE_DIR": tempfile.mkdtemp()})
 
 import workflow
 
@@ -32,7 +35,7 @@ def save_files(files, owner, repo, **kwargs):
 
 
 workflow.download_from_dropbox = lambda x: files_iterator
-workflow.unzip_files = lambda x: x  # No-op since files are already in the correct format
+workflow.unzip_files = SimpleNamespace(run=lambda x, **kwargs: x)  # No-op since files are already in the correct format
 workflow.publish_to_github = save_files
 
 workflow.run()
@@ -0,0 +1,67 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    A local HTTP server that fakes an API. Subclasses implement `route(method, path, headers, body)`, which receives
+    the parsed JSON body (or None) and returns (status, response). A bytes response is sent as is, anything else as
+    JSON. Requests are routed one at a time, so `route()` can change the server's state without locking.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeServerHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.lock = threading.Lock()
+
+    def route(self, method, path, headers, body):
+        raise NotImplementedError
+
+
+class _FakeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def _handle(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        with self.server.lock:
+            status, response = self.server.route(method, self.path, self.headers, body)
+
+        data = response if isinstance(response, bytes) else json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def serve():
+    "Starts a `FakeServer` in a background thread, e.g. `server = serve(FakeDropbox())`, until the end of the test"
+    servers = []
+
+    def start(server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+from tasks import download_from_dropbox
+from tests.conftest import FakeServer
+
+
+class FakeDropbox(FakeServer):
+    "The Dropbox API endpoints used by `sync()`. Cursors are 'page:N' (the second page of a listing) or 'log:N'"
+
+    def __init__(self):
+        super().__init__()
+        self.files = {}  # display path -> contents
+        self.log = []  # the entries that changed, in order
+        self.downloads = []
+
+    def change(self, path, contents):
+        if contents is None:
+            del self.files[path]
+            self.log.append({".tag": "deleted", "path_lower": path.lower(), "path_display": path})
+        else:
+            self.files[path] = contents
+            self.log.append({".tag": "file", "path_lower": path.lower(), "path_display": path})
+
+    def list_folder(self):
+        entries = [{".tag": "folder", "path_lower": "/journal/notes", "path_display": "/Journal/notes"}]
+        entries += [{".tag": "file", "path_lower": path.lower(), "path_display": path} for path in self.files]
+        return entries
+
+    def route(self, method, path, headers, body):
+        if path == "/2/files/list_folder":
+            entries = self.list_folder()
+            half = len(entries) // 2
+            return 200, {"entries": entries[:half], "cursor": f"page:{half}:{len(self.log)}", "has_more": True}
+
+        if path == "/2/files/list_folder/continue":
+            kind, *pos = body["cursor"].split(":")
+            if kind == "page":
+                entries = self.list_folder()[int(pos[0]) :]
+                return 200, {"entries": entries, "cursor": f"log:{pos[1]}", "has_more": False}
+            if kind == "log":
+                entries = self.log[int(pos[0]) :]
+                return 200, {"entries": entries, "cursor": f"log:{len(self.log)}", "has_more": False}
+            return 409, {"error_summary": "reset/...", "error": {".tag": "reset"}}
+
+        if path == "/2/files/download":
+            file_path = json.loads(headers["Dropbox-API-Arg"])["path"]
+            self.downloads.append(file_path)
+            contents = {p.lower(): c for p, c in self.files.items()}.get(file_path)
+            if contents is None:
+                return 409, {"error_summary": "path/not_found/..."}
+            return 200, contents
+
+        return 404, {"error_summary": f"unknown endpoint {path}"}
+
+
+@pytest.fixture
+def dropbox(serve, monkeypatch, tmp_path):
+    server = serve(FakeDropbox())
+
+    monkeypatch.setattr(download_from_dropbox, "DROPBOX_API_URL", server.url)
+    monkeypatch.setattr(download_from_dropbox, "DROPBOX_CONTENT_URL", server.url)
+    monkeypatch.setattr(download_from_dropbox, "DROPBOX_FOLDER_PATH", "/Journal")
+    monkeypatch.setattr(download_from_dropbox, "DROPBOX_MIRROR_DIR", str(tmp_path / "mirror"))
+    monkeypatch.setattr(download_from_dropbox, "get_access_token", lambda: "token")
+    return server
+
+
+def seed(dropbox, num_files=3):
+    for i in range(num_files):
+        dropbox.files[f"/Journal/notes/File {i}.txt"] = f"file {i}".encode()
+
+
+def test_first_sync_downloads_every_file(dropbox):
+    seed(dropbox)
+
+    files = download_from_dropbox.sync(None)
+
+    assert files == [(f"Journal/notes/File {i}.txt", f"file {i}".encode()) for i in range(3)]
+    assert len(dropbox.downloads) == 3
+
+
+def test_sync_downloads_only_the_changes(dropbox):
+    seed(dropbox)
+    download_from_dropbox.sync(None)
+    dropbox.downloads.clear()
+
+    dropbox.change("/Journal/notes/File 1.txt", b"file 1, edited")
+    dropbox.change("/Journal/notes/File 2.txt", None)
+    dropbox.change("/Journal/notes/File 3.txt", b"file 3")
+    files = download_from_dropbox.sync(None)
+
+    assert files == [
+        ("Journal/notes/File 0.txt", b"file 0"),
+        ("Journal/notes/File 1.txt", b"file 1, edited"),
+        ("Journal/notes/File 3.txt", b"file 3"),
+    ]
+    assert sorted(dropbox.downloads) == ["/journal/notes/file 1.txt", "/journal/notes/file 3.txt"]
+
+    dropbox.downloads.clear()
+    assert download_from_dropbox.sync(None) == files
+    assert dropbox.downloads == []
+
+
+def test_cursor_reset_does_a_full_sync(dropbox):
+    seed(dropbox)
+    download_from_dropbox.sync(None)
+
+    mirror = download_from_dropbox.Mirror(download_from_dropbox.DROPBOX_MIRROR_DIR, "/Journal")
+    mirror.save("expired")  # the fake server resets any cursor it doesn't know
+    del dropbox.files["/Journal/notes/File 0.txt"]  # removed without a log entry, so only a full sync sees it
+    dropbox.downloads.clear()
+
+    files = download_from_dropbox.sync(None)
+
+    assert [name for name, _ in files] == ["Journal/notes/File 1.txt", "Journal/notes/File 2.txt"]
+    assert len(dropbox.downloads) == 2
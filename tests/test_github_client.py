@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from tasks.github_client import GitHubClient
+
+
+def response(status, body=b"", **headers):
+    return SimpleNamespace(status=status, data=body, headers={k.replace("_", "-"): v for k, v in headers.items()})
+
+
+SECONDARY_RATE_LIMIT = b'{"message": "You have exceeded a secondary rate limit."}'
+
+
+def test_secondary_rate_limit_fails_fast():
+    client = GitHubClient()
+    resp = response(403, SECONDARY_RATE_LIMIT, X_RateLimit_Remaining="4000")
+
+    assert client._get_retry_delay(resp, attempt=0, budget=client.max_retry_delay) is None
+
+
+def test_secondary_rate_limit_is_retried_after_a_minute_if_the_budget_allows():
+    client = GitHubClient()
+    resp = response(403, SECONDARY_RATE_LIMIT, X_RateLimit_Remaining="4000")
+
+    assert 60 <= client._get_retry_delay(resp, attempt=0, budget=90) <= 61
+    assert client._get_retry_delay(resp, attempt=1, budget=90) is None
+
+
+def test_forbidden_is_not_retried():
+    client = GitHubClient()
+    resp = response(403, b'{"message": "Resource not accessible by integration"}', X_RateLimit_Remaining="4000")
+
+    assert client._get_retry_delay(resp, attempt=0, budget=client.max_retry_delay) is None
+
+
+def test_retry_after_is_used():
+    client = GitHubClient()
+    resp = response(429, Retry_After="5")
+
+    assert 5 <= client._get_retry_delay(resp, attempt=0, budget=client.max_retry_delay) <= 6
+    assert client._get_retry_delay(resp, attempt=0, budget=3) is None
@@ -0,0 +1,475 @@
+import io
+import os
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+from functools import partial
+
+import pytest
+
+from liteflow import run, run_async, sharded, cached, task_name, Tracer, MemoryStore, DiskStore, S3Store, TieredStore
+
+
+def branches(*tasks):
+    "A dict workflow that runs all the tasks in parallel, in this order (unlike a set, a dict keeps its order)"
+    return {(lambda data, i=i: True): task for i, task in enumerate(tasks)}
+
+
+def sleep_then(seconds, value):
+    def task(data):
+        time.sleep(seconds)
+        return value
+
+    return task
+
+
+class Concurrency:
+    "Counts the tasks that are running at the same time"
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def task(self, data):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return data
+
+
+def test_sequence_passes_each_output_to_the_next_task():
+    assert run([lambda x: x + 1, lambda x: x * 10], 1) == 20
+
+
+def test_parallel_results_are_in_branch_order():
+    workflow = branches(sleep_then(0.1, "a"), sleep_then(0.05, "b"), sleep_then(0, "c"))
+
+    assert run(workflow) == ["a", "b", "c"]
+
+
+def test_set_branches_run_in_parallel():
+    barrier = threading.Barrier(3, timeout=5)  # fails if the branches run one after another
+    workflow = {(barrier.wait, lambda _: "a"), (barrier.wait, lambda _: "b"), (barrier.wait, lambda _: "c")}
+
+    assert sorted(run(workflow)) == ["a", "b", "c"]
+
+
+def test_first_error_is_raised_and_pending_branches_are_cancelled():
+    started = []
+
+    def fail(data):
+        raise ValueError("failed")
+
+    def pending(data):
+        started.append(data)
+        time.sleep(0.1)
+
+    workflow = branches(sleep_then(0.2, "slow"), fail, *[pending] * 4)
+
+    with pytest.raises(ValueError, match="failed"):
+        run(workflow, max_workers=2)
+    assert len(started) <= 1  # only the one that the failed branch's thread picked up, before the error was seen
+
+
+def test_max_workers_caps_the_running_tasks():
+    concurrency = Concurrency()
+
+    run(branches(*[concurrency.task] * 6), max_workers=2)
+
+    assert concurrency.max_running == 2
+
+
+def test_dict_runs_the_matching_branches():
+    workflow = {
+        "a": lambda data: "key match",
+        "b": lambda data: "other key",
+        (lambda data: data.startswith("a")): lambda data: "predicate match",
+        (lambda data: False): lambda data: "predicate mismatch",
+    }
+
+    assert run(workflow, "a") == ["key match", "predicate match"]
+
+
+def double(items):
+    return [item * 2 for item in items]
+
+
+def fail_on_three(items):
+    if 3 in items:
+        raise ValueError("three")
+    return items
+
+
+def exit_in_shard_process(items):
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return double(items)
+
+
+def test_sharded_joins_the_outputs_in_order():
+    assert sharded(double, max_processes=2)(range(10)) == double(range(10))
+
+
+def test_sharded_raises_task_errors():
+    with pytest.raises(ValueError, match="three"):
+        sharded(fail_on_three, max_processes=2)(range(10))
+
+
+def test_sharded_runs_in_process_if_the_processes_exit():
+    assert sharded(exit_in_shard_process, max_processes=2)(range(10)) == double(range(10))
+
+
+class Selector:
+    "Records the items that it receives"
+
+    def __init__(self, accepted):
+        self.accepted = accepted
+        self.received = []
+
+    def accepts(self, item):
+        return item in self.accepted
+
+    def run(self, items):
+        for item in items:
+            self.received.append(item)
+        return self.received
+
+
+def test_streamed_branches_receive_only_the_items_they_accept():
+    evens, odds = Selector({0, 2, 4}), Selector({1, 3})
+
+    run([{(evens,), (odds, sum)}], (i for i in range(5)), stream=True)
+
+    assert evens.received == [0, 2, 4]
+    assert odds.received == [1, 3]
+
+
+def within(seconds, func, *args, **kwargs):
+    "Calls the function in a thread, and fails (instead of hanging) if it doesn't return in time, e.g. on a deadlock"
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), f"didn't finish in {seconds} seconds"
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def numbers(count, produced=None):
+    for i in range(count):
+        if produced is not None:
+            produced.append(i)
+        yield i
+
+
+def first_item(items):
+    for item in items:
+        return item
+
+
+def test_streamed_branch_that_stops_early_doesnt_block_the_others():
+    workflow = [numbers, branches(first_item, sum, list)]
+
+    assert within(5, run, workflow, 1000, stream=True, stream_buffer=4) == [0, 499500, list(range(1000))]
+
+
+def test_streamed_branch_error_is_raised():
+    def fail_on_ten(items):
+        for item in items:
+            if item == 10:
+                raise ValueError("ten")
+
+    with pytest.raises(ValueError, match="ten"):
+        within(5, run, [numbers, branches(fail_on_ten, sum)], 1000, stream=True, stream_buffer=4)
+
+
+def test_streamed_source_error_is_raised():
+    def failing_source(data):
+        yield from range(10)
+        raise ValueError("source")
+
+    with pytest.raises(ValueError, match="source"):
+        within(5, run, [failing_source, branches(sum, list)], None, stream=True, stream_buffer=4)
+
+
+def test_streamed_source_doesnt_run_ahead_of_the_slowest_branch():
+    produced = []
+    slow_branch_started = threading.Event()
+    lead = []
+
+    def slow(items):
+        slow_branch_started.wait(5)
+        lead.append(len(produced))  # how far the source got before this branch read anything
+        return sum(items)
+
+    def source(data):
+        return numbers(100, produced)
+
+    def start_slow_branch():
+        time.sleep(0.2)  # give the source time to run ahead, if it isn't bounded
+        slow_branch_started.set()
+
+    threading.Thread(target=start_slow_branch, daemon=True).start()
+    results = within(5, run, [source, branches(slow, sum)], None, stream=True, stream_buffer=4)
+
+    assert results == [4950, 4950]
+    assert lead[0] <= 4 + 1  # the buffer, plus the item that the source is blocked on
+
+
+def async_sleep_then(seconds, value):
+    async def task(data):
+        await asyncio.sleep(seconds)
+        return value
+
+    return task
+
+
+def test_async_results_are_in_branch_order():
+    workflow = [
+        lambda data: data + 1,  # regular functions run in the default executor
+        branches(async_sleep_then(0.1, "a"), async_sleep_then(0, "b"), lambda data: data),
+    ]
+
+    assert asyncio.run(run_async(workflow, 1)) == ["a", "b", 2]
+
+
+def test_async_error_cancels_the_other_branches():
+    cancelled = []
+
+    async def fail(data):
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    async def slow(data):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(ValueError, match="failed"):
+        asyncio.run(run_async(branches(fail, slow)))
+    assert cancelled == [True]
+
+
+def test_async_max_workers_caps_the_running_tasks():
+    running = []
+    max_running = []
+
+    async def task(data):
+        running.append(data)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(data)
+
+    asyncio.run(run_async(branches(*[task] * 6), max_workers=2))
+
+    assert max(max_running) == 2
+
+
+def add(items, amount=1, token=None):
+    return [item + amount for item in items]
+
+
+def test_cached_returns_the_stored_output():
+    calls = []
+    task = cached(lambda items: calls.append(items) or [item * 2 for item in items], MemoryStore())
+
+    assert task([1, 2]) == [2, 4]
+    assert task([1, 2]) == [2, 4]
+    assert task([3]) == [6]
+    assert calls == [[1, 2], [3]]
+    assert (task.hits, task.misses) == (1, 2)
+
+
+def test_cache_keys_depend_on_the_partial_arguments():
+    store = MemoryStore()
+
+    def key(task):
+        return cached(task, store).cache_key([1])
+
+    assert key(partial(add, amount=2)) == key(partial(add, amount=2))
+    assert key(partial(add, amount=2)) != key(partial(add, amount=3))
+    assert key(partial(add, token="a")) != key(partial(add, token="b"))  # secrets aren't masked in keys
+    assert key(partial(add, cache=MemoryStore())) == key(partial(add, cache=MemoryStore()))  # no object addresses
+    assert cached(add, store, version=1).cache_key([1]) != cached(add, store, version=2).cache_key([1])
+
+
+def test_cached_skips_inputs_that_cant_be_pickled():
+    store = MemoryStore()
+    task = cached(lambda data: "output", store)
+    unpicklable = threading.Lock()
+
+    assert task(unpicklable) == "output"
+    assert task(unpicklable) == "output"
+    assert task.misses == 2
+    assert store._size == 0
+
+
+def test_memory_store_evicts_the_least_recently_used():
+    store = MemoryStore(max_bytes=10)
+    store.put("a", b"aaaa")
+    store.put("b", b"bbbb")
+    store.get("a")  # "b" is now the least recently used
+    store.put("c", b"cccc")
+
+    assert store.get("a") == b"aaaa"
+    assert store.get("b") is None
+    assert store.get("c") == b"cccc"
+    assert store._size == 8
+
+    store.put("a", b"aa")  # replacing a value updates the size
+    assert store._size == 6
+
+    store.put("big", b"x" * 11)  # bigger than the store
+    assert store.get("big") is None
+
+
+def test_disk_store_evicts_the_least_recently_used(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=10)
+    store.put("a", b"aaaa")
+    store.put("b", b"bbbb")
+    os.utime(tmp_path / "a", (1000, 1000))
+    os.utime(tmp_path / "b", (2000, 2000))
+    assert store.get("a") == b"aaaa"  # marks "a" as recently used, so "b" is now the oldest
+
+    store.put("c", b"cccc")
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    assert store._size == 8
+    assert DiskStore(str(tmp_path), max_bytes=10)._size == 8  # the size is counted again when reopened
+
+
+def test_disk_store_get_of_a_missing_key(tmp_path):
+    assert DiskStore(str(tmp_path)).get("missing") is None
+
+
+def test_tiered_store_copies_hits_to_the_faster_stores(tmp_path):
+    fast, slow = MemoryStore(), DiskStore(str(tmp_path))
+    slow.put("a", b"aaaa")
+    store = TieredStore(fast, slow)
+
+    assert store.get("a") == b"aaaa"
+    assert fast.get("a") == b"aaaa"
+
+    store.put("b", b"bbbb")
+    assert fast.get("b") == slow.get("b") == b"bbbb"
+
+
+class FakeS3Client:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+
+def test_s3_store_keeps_entries_under_the_prefix():
+    client = FakeS3Client()
+    store = S3Store("bucket", prefix="/cache/", client=client)
+
+    assert store.get("a") is None
+    store.put("a", b"aaaa")
+
+    assert store.get("a") == b"aaaa"
+    assert list(client.objects) == [("bucket", "cache/a")]
+
+
+def publish(items, repo, token):
+    return items
+
+
+def test_tracer_records_a_span_for_every_step():
+    tracer = Tracer()
+    workflow = [lambda data: [1, 2, 3], branches(len, partial(publish, repo="blog", token="secret"))]
+
+    run(workflow, tracer=tracer)
+
+    spans = {tuple(span["path"]): span for span in tracer.spans}
+    assert sorted(spans) == [(), (0,), (1,), (1, 0), (1, 1)]
+    assert [spans[path]["kind"] for path in sorted(spans)] == ["sequence", "task", "parallel", "task", "task"]
+    assert spans[(1, 1)]["name"] == "tests.test_liteflow.publish(repo='blog', token=***)"
+    assert spans[(0,)]["items_out"] == 3
+    assert spans[(1,)]["items_out"] == 2
+    assert all(span["wall_time"] >= 0 and span["error"] is None for span in spans.values())
+
+
+def test_tracer_masks_secret_arguments():
+    assert task_name(partial(publish, "posts", password="hunter2", api_key="abc")) == (
+        "tests.test_liteflow.publish('posts', password=***, api_key=***)"
+    )
+
+
+def test_tracer_records_errors():
+    tracer = Tracer()
+
+    def fail(data):
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        run([fail], tracer=tracer)
+
+    assert [span["error"] for span in tracer.spans] == ["ValueError('failed')", "ValueError('failed')"]
+
+
+def test_tracer_measures_memory_only_for_tasks_that_dont_overlap():
+    tracer = Tracer()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def allocate(data):
+        return bytearray(1024 * 1024)
+
+    def wait(data):
+        barrier.wait()  # both branches are running at the same time
+
+    run([allocate, branches(wait, wait)], tracer=tracer)
+
+    mem_deltas = {tuple(span["path"]): span["mem_delta"] for span in tracer.spans if span["kind"] == "task"}
+    assert mem_deltas[(0,)] >= 1024 * 1024
+    assert mem_deltas[(1, 0)] is None and mem_deltas[(1, 1)] is None
+
+
+def test_chrome_trace_export(tmp_path):
+    tracer = Tracer(trace_memory=False)
+    run([lambda data: data, branches(lambda data: 1, lambda data: 2)], tracer=tracer)
+
+    file_path = tmp_path / "trace.json"
+    tracer.save_chrome_trace(file_path)
+    with open(file_path) as f:
+        trace = json.load(f)
+
+    events = trace["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    thread_names = [event for event in events if event["ph"] == "M"]
+    assert len(spans) == len(tracer.spans) == 5
+    assert trace["displayTimeUnit"] == "ms"
+    for event in spans:
+        assert event.keys() == {"name", "cat", "ph", "ts", "dur", "pid", "tid", "args"}
+        assert event["ts"] >= 0 and event["dur"] >= 0
+        assert event["cat"] in ("sequence", "parallel", "task")
+    assert {event["tid"] for event in spans} == {event["tid"] for event in thread_names}
+    assert all(event["name"] == "thread_name" and event["args"]["name"] for event in thread_names)
@@ -0,0 +1,162 @@
+import re
+import json
+import hashlib
+
+import pytest
+
+from tasks import github_client, publish_to_github
+from tasks.publish_to_github import _get_blob_sha
+from tests.conftest import FakeServer
+
+
+class FakeGitHub(FakeServer):
+    "The Git Data API endpoints used by `publish_to_github`, for a single branch. Trees are stored as flat dicts."
+
+    def __init__(self):
+        super().__init__()
+        self.blobs = {}  # sha -> contents
+        self.trees = {}  # sha -> {path: blob sha}
+        self.commits = {}  # sha -> (tree sha, parents)
+        self.head = None
+        self.requests = []  # (method, path, body)
+        self.moves_before_update = False  # simulate another commit on the branch, right before the ref update
+
+    def commit(self, files, parents=()):
+        "Commits the files (a dict of path -> str) as the new contents of the branch"
+        tree = {}
+        for path, contents in files.items():
+            tree[path] = self.put_blob(contents.encode())
+        self.head = self.put_commit(self.put_tree(tree), list(parents))
+        return self.head
+
+    def files(self):
+        tree_sha, _ = self.commits[self.head]
+        return {path: self.blobs[sha].decode() for path, sha in self.trees[tree_sha].items()}
+
+    def put_blob(self, data):
+        sha = _get_blob_sha(data)
+        self.blobs[sha] = data
+        return sha
+
+    def put_tree(self, tree):
+        sha = hashlib.sha1(json.dumps(sorted(tree.items())).encode()).hexdigest()
+        self.trees[sha] = tree
+        return sha
+
+    def put_commit(self, tree_sha, parents):
+        sha = hashlib.sha1(f"{tree_sha}{parents}{len(self.commits)}".encode()).hexdigest()
+        self.commits[sha] = (tree_sha, parents)
+        return sha
+
+    def list_tree(self, tree, recursive):
+        entries = {}
+        for path, sha in sorted(tree.items()):
+            parts = path.split("/")
+            for i in range(1, len(parts) if recursive else min(len(parts), 2)):
+                subtree = "/".join(parts[:i])
+                prefix = subtree + "/"
+                children = {p[len(prefix) :]: s for p, s in tree.items() if p.startswith(prefix)}
+                entries[subtree] = {"path": subtree, "type": "tree", "sha": self.put_tree(children)}
+            if recursive or len(parts) == 1:
+                entries[path] = {"path": path, "type": "blob", "sha": sha}
+        return list(entries.values())
+
+    def route(self, method, path, headers, body):
+        self.requests.append((method, path, body))
+        path, _, query = path.partition("?")
+        kind, sha = re.match(r"/repos/[^/]+/[^/]+/git/(\w+)(?:/heads)?(?:/(\w+))?$", path).groups()
+
+        if method == "GET" and kind == "ref":
+            return 200, {"object": {"sha": self.head}}
+        if method == "GET" and kind == "commits":
+            return 200, {"sha": sha, "tree": {"sha": self.commits[sha][0]}}
+        if method == "GET" and kind == "trees":
+            return 200, {"sha": sha, "tree": self.list_tree(self.trees[sha], "recursive" in query)}
+        if method == "POST" and kind == "blobs":
+            return 201, {"sha": self.put_blob(body["content"].encode())}
+        if method == "POST" and kind == "trees":
+            tree = dict(self.trees[body["base_tree"]])
+            for entry in body["tree"]:
+                if "content" in entry:
+                    tree[entry["path"]] = self.put_blob(entry["content"].encode())
+                elif entry["sha"] is None:
+                    if entry["path"] not in tree:
+                        return 422, {"message": "GitRPC::BadObjectState"}
+                    del tree[entry["path"]]
+                elif entry["sha"] in self.blobs:
+                    tree[entry["path"]] = entry["sha"]
+                else:
+                    return 422, {"message": "Invalid tree info"}
+            return 201, {"sha": self.put_tree(tree)}
+        if method == "POST" and kind == "commits":
+            return 201, {"sha": self.put_commit(body["tree"], body["parents"])}
+        if method == "PATCH" and kind == "refs":
+            if self.moves_before_update:
+                self.head = self.put_commit(self.commits[self.head][0], [self.head])
+            if not body["force"] and self.head not in self.commits[body["sha"]][1]:
+                return 422, {"message": "Update is not a fast forward"}
+            self.head = body["sha"]
+            return 200, {"object": {"sha": self.head}}
+
+        return 404, {"message": "Not Found"}
+
+
+@pytest.fixture
+def github(serve, monkeypatch):
+    server = serve(FakeGitHub())
+    monkeypatch.setattr(github_client, "client", github_client.GitHubClient(api_url=server.url))
+
+    server.commit({"README.md": "readme", "content/posts/old.md": "old", "content/posts/2024/kept.md": "kept"})
+
+    return server
+
+
+def publish(files):
+    publish_to_github.run(files, "owner", "repo", "main", "token", prefix="content/posts")
+
+
+def tree_requests(github):
+    return [body for method, path, body in github.requests if method == "POST" and path.endswith("/git/trees")]
+
+
+def test_small_files_are_sent_inline_and_big_files_as_blobs(github, monkeypatch):
+    monkeypatch.setattr(publish_to_github, "MAX_INLINE_FILE_SIZE", 10)
+
+    publish([("small.md", "small"), ("big.md", "a big post, over the inline limit")])
+
+    [tree_request] = tree_requests(github)
+    small, big = tree_request["tree"]
+    assert small == {"path": "content/posts/small.md", "mode": "100644", "type": "blob", "content": "small"}
+    assert big["path"] == "content/posts/big.md" and big["sha"] == _get_blob_sha(b"a big post, over the inline limit")
+    assert len([path for method, path, _ in github.requests if path.endswith("/git/blobs")]) == 1
+
+    files = github.files()
+    assert files["content/posts/small.md"] == "small"
+    assert files["content/posts/big.md"] == "a big post, over the inline limit"
+    assert files["README.md"] == "readme"
+
+
+def test_deleted_files_are_removed_with_a_null_sha(github):
+    publish([("old.md", None), ("never-published.md", None), ("2024/kept.md", "kept")])
+
+    [tree_request] = tree_requests(github)
+    assert tree_request["tree"] == [{"path": "content/posts/old.md", "mode": "100644", "type": "blob", "sha": None}]
+    assert github.files() == {"README.md": "readme", "content/posts/2024/kept.md": "kept"}
+
+
+def test_unchanged_files_are_not_committed(github):
+    head = github.head
+
+    publish([("old.md", "old"), ("2024/kept.md", "kept")])
+
+    assert tree_requests(github) == []
+    assert github.head == head
+
+
+def test_branch_that_moved_is_not_overwritten(github):
+    github.moves_before_update = True
+
+    with pytest.raises(RuntimeError, match="not a fast forward"):
+        publish([("new.md", "new")])
+
+    assert "content/posts/new.md" not in github.files()
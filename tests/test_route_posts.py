@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from liteflow import run
+from tasks.route_posts import Router
+from tasks.split_blog_entries import Post
+
+PROJECT_TAGS = {"easydiffusion": ["#easydiffusion", "#sdkit"], "freebird": ["#freebird"]}
+ROUTES = {
+    "blog": {},
+    "easydiffusion": {"project": "easydiffusion"},
+    "freebird": {"project": "freebird", "exclude_tags": ["#worklog"]},
+}
+
+
+def entry(key, *tags):
+    return key, Post(id=key, time=datetime(2024, 10, 14), tags=list(tags), body="")
+
+
+POSTS = [
+    entry("plain"),
+    entry("ed", "#sdkit"),
+    entry("both", "#sdkit", "#freebird"),  # the first project in PROJECT_TAGS wins
+    entry("fb", "#freebird"),
+    entry("fb-worklog", "#freebird", "#worklog"),
+]
+
+
+def keys(entries):
+    return [key for key, _ in entries]
+
+
+def test_posts_are_routed_to_their_targets():
+    routed = Router(PROJECT_TAGS, ROUTES).run(POSTS)
+
+    assert keys(routed["blog"]) == ["plain", "ed", "both", "fb", "fb-worklog"]
+    assert keys(routed["easydiffusion"]) == ["ed", "both"]
+    assert keys(routed["freebird"]) == ["fb"]
+    assert [post.project for _, post in POSTS] == [None, "easydiffusion", "easydiffusion", "freebird", "freebird"]
+
+
+def test_streamed_posts_are_routed_to_their_targets():
+    router = Router(PROJECT_TAGS, ROUTES)
+    workflow = [
+        router.run,
+        {(router.target("blog"), keys), (router.target("easydiffusion"), keys), (router.target("freebird"), keys)},
+    ]
+
+    outputs = run(workflow, (entry for entry in POSTS), stream=True)
+
+    assert sorted(outputs) == [["ed", "both"], ["fb"], ["plain", "ed", "both", "fb", "fb-worklog"]]
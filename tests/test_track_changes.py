@@ -0,0 +1,116 @@
+from liteflow import MemoryStore
+from tasks import split_blog_entries, convert_to_frontmatter
+from tasks.convert_to_frontmatter import get_filepath
+from tasks.route_posts import Router
+from tasks.track_changes import ChangeTracker
+
+PROJECT_TAGS = {"freebird": ["#freebird"]}
+ROUTES = {"blog": {}, "freebird": {"project": "freebird", "exclude_tags": ["#worklog"]}}
+
+OCTOBER = "notes/October 2024.txt"
+NOVEMBER = "notes/November 2024.txt"
+
+
+def journal(*posts):
+    return "\n\n--\n\n".join(posts).encode()
+
+
+POST_A = "Mon Oct 14 10:22:33 2024\n#freebird\n\nfirst post"
+POST_B = "Tue Oct 15 11:00:00 2024\nslug: second\n\nsecond post"
+POST_C = "Fri Nov 01 08:00:00 2024\n\nthird post"
+
+
+def path_of(post):
+    "The post ids are local timestamps, so the paths depend on the timezone"
+    return get_filepath(split_blog_entries.process_post(post))
+
+
+PATH_A = path_of(POST_A)
+PATH_B = path_of(POST_B)
+PATH_C = path_of(POST_C)
+
+
+def publish(store, files, target="blog", existing_files=None):
+    "Runs the publish pipeline of a target, and returns a dict of path -> content (None for deleted outputs)"
+    changes = ChangeTracker(store, existing_files)
+    router = Router(PROJECT_TAGS, ROUTES)
+    index = changes.index(target, get_filepath)
+
+    posts = router.target(target).run(router.run(split_blog_entries.run(changes.track_files(files))))
+    outputs = dict(index.add_deletions(convert_to_frontmatter.run(index.select(posts))))
+    changes.save()
+    return outputs
+
+
+def test_unchanged_posts_are_skipped():
+    store = MemoryStore()
+    files = [(OCTOBER, journal(POST_A, POST_B)), (NOVEMBER, journal(POST_C))]
+
+    assert set(publish(store, files)) == {PATH_A, PATH_B, PATH_C}
+    assert publish(store, files) == {}
+
+
+def test_post_removed_from_file():
+    store = MemoryStore()
+    publish(store, [(OCTOBER, journal(POST_A, POST_B)), (NOVEMBER, journal(POST_C))])
+
+    outputs = publish(store, [(OCTOBER, journal(POST_A)), (NOVEMBER, journal(POST_C))])
+    assert outputs == {PATH_B: None}
+
+
+def test_file_removed():
+    store = MemoryStore()
+    publish(store, [(OCTOBER, journal(POST_A, POST_B)), (NOVEMBER, journal(POST_C))])
+
+    outputs = publish(store, [(OCTOBER, journal(POST_A, POST_B))])
+    assert outputs == {PATH_C: None}
+
+
+def test_file_removed_while_skipping_unchanged_files():
+    store = MemoryStore()
+    files = [(OCTOBER, journal(POST_A, POST_B)), (NOVEMBER, journal(POST_C))]
+    publish(store, files, existing_files={OCTOBER, NOVEMBER})
+
+    outputs = publish(store, [], existing_files={OCTOBER})
+    assert outputs == {PATH_C: None}
+
+
+def test_posts_of_skipped_files_are_kept():
+    store = MemoryStore()
+    files = [(OCTOBER, journal(POST_A, POST_B)), (NOVEMBER, journal(POST_C))]
+    publish(store, files, existing_files={OCTOBER, NOVEMBER})
+
+    outputs = publish(store, [(NOVEMBER, journal(POST_C))], existing_files={OCTOBER, NOVEMBER})
+    assert outputs == {}
+
+
+def test_post_stops_matching_route():
+    store = MemoryStore()
+    assert set(publish(store, [(OCTOBER, journal(POST_A, POST_B))], target="freebird")) == {PATH_A}
+
+    worklog_post = POST_A.replace("#freebird", "#freebird #worklog")
+    outputs = publish(store, [(OCTOBER, journal(worklog_post, POST_B))], target="freebird")
+    assert outputs == {PATH_A: None}
+
+
+def test_slug_changed():
+    store = MemoryStore()
+    publish(store, [(OCTOBER, journal(POST_A, POST_B))])
+
+    renamed_post = POST_B.replace("slug: second", "slug: renamed")
+    outputs = publish(store, [(OCTOBER, journal(POST_A, renamed_post))])
+    assert outputs.keys() == {"2024-10-15-renamed.md", PATH_B}
+    assert outputs[PATH_B] is None
+    assert outputs["2024-10-15-renamed.md"] is not None
+
+
+def test_version_change_publishes_again_and_deletes_old_outputs():
+    store = MemoryStore()
+    publish(store, [(OCTOBER, journal(POST_A, POST_B))])
+
+    changes = ChangeTracker(store, version=2)
+    index = changes.index("blog", get_filepath)
+    posts = list(split_blog_entries.run(changes.track_files([(OCTOBER, journal(POST_A))])))
+    outputs = dict(index.add_deletions(convert_to_frontmatter.run(index.select(posts))))
+    assert outputs.keys() == {PATH_A, PATH_B}
+    assert outputs[PATH_B] is None
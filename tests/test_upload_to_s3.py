@@ -0,0 +1,84 @@
+import os
+import hashlib
+import threading
+
+import pytest
+
+os.environ.setdefault("IS_LOCAL_TEST", "1")  # don't create a boto3 client on import
+
+from tasks import upload_to_s3
+
+
+class FakeS3:
+    "The S3 client methods used by `upload_to_s3`. Listings are paged, two objects per page."
+
+    def __init__(self, objects, failing_keys=()):
+        self.objects = dict(objects)  # key -> contents
+        self.failing_keys = set(failing_keys)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        for i in range(0, len(keys), 2):
+            page = keys[i : i + 2]
+            yield {"Contents": [{"Key": key, "ETag": f'"{self._md5(key)}"'} for key in page]}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call("put", Key)
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self._call("delete", Key)
+        del self.objects[Key]
+
+    def _md5(self, key):
+        return hashlib.md5(self.objects[key]).hexdigest()
+
+    def _call(self, method, key):
+        with self.lock:
+            self.calls.append((method, key))
+        if key in self.failing_keys:
+            raise ConnectionError(f"Failed to {method} {key}")
+
+
+def existing_objects():
+    return {"blog/a.html": b"a", "blog/b.html": b"b", "blog/c.html": b"c", "other/d.html": b"d"}
+
+
+def test_only_changed_files_are_uploaded():
+    client = FakeS3(existing_objects())
+
+    report = upload_to_s3.run(
+        [("a.html", "a"), ("b.html", b"b, edited"), ("c.html", "c"), ("d.html", "d")], "bucket", "blog", client=client
+    )
+
+    assert sorted(client.calls) == [("put", "blog/b.html"), ("put", "blog/d.html")]
+    assert report == {"uploaded": ["b.html", "d.html"], "deleted": [], "unchanged": 2, "failed": {}}
+    assert client.objects["blog/b.html"] == b"b, edited"
+
+
+def test_deleted_files_are_removed():
+    client = FakeS3(existing_objects())
+
+    report = upload_to_s3.run([("a.html", None), ("missing.html", None)], "bucket", "blog", client=client)
+
+    assert client.calls == [("delete", "blog/a.html")]
+    assert report["deleted"] == ["a.html"]
+    assert "blog/a.html" not in client.objects
+
+
+def test_failed_upload_raises_after_the_other_uploads():
+    client = FakeS3(existing_objects(), failing_keys={"blog/b.html"})
+    files = [("a.html", "a, edited"), ("b.html", "b, edited"), ("c.html", None)]
+
+    with pytest.raises(Exception, match="Failed to upload 1 files to S3"):
+        upload_to_s3.run(files, "bucket", "blog", client=client)
+
+    assert client.objects["blog/a.html"] == b"a, edited"
+    assert client.objects["blog/b.html"] == b"b"
+    assert "blog/c.html" not in client.objects
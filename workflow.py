@@ -1,13 +1,19 @@
 import os
+import json
+import hashlib
 
 from tasks import (
     download_from_dropbox,
     unzip_files,
     split_blog_entries,
 )
-from tasks.convert_to_frontmatter import run as convert_to_frontmatter
+from tasks.convert_to_frontmatter import run as convert_to_frontmatter, get_filepath, RENDER_VERSION
+from tasks.split_blog_entries import PARSER_VERSION
 from tasks.publish_to_github import run as publish_to_github
-from liteflow import run as _run
+from tasks.unzip_files import Manifest
+from tasks.track_changes import ChangeTracker
+from tasks.route_posts import Router
+from liteflow import run as _run, sharded, MemoryStore, DiskStore, TieredStore
 
 from functools import partial
 from dataclasses import replace
@@ -34,48 +40,65 @@ CMDR2_BLOG_GH_CONFIG = {
     "token": os.environ.get("CMDR2_BLOG_GITHUB_TOKEN"),
 }
 
+# state that's kept between the invocations of a warm Lambda, e.g. which files were published successfully
+STATE_DIR = os.environ.get("STATE_DIR", "/tmp/blog-agent")
 
-def classify_posts_by_project(files):
-    for _, post in files:
-        post.project = None
-        if "#easydiffusion" in post.tags or "#sdkit" in post.tags:
-            post.project = "easydiffusion"
-        elif "#freebird" in post.tags:
-            post.project = "freebird"
-    return files
+# the parsed posts of each file, so that only the files that changed are parsed again
+PARSE_CACHE = DiskStore(os.path.join(STATE_DIR, "parse-cache"), max_bytes=64 * 1024 * 1024)
 
+# the files in each GitHub repo at the last commit that we saw (or made), to skip fetching the tree if it hasn't changed
+GITHUB_TREE_CACHE = DiskStore(os.path.join(STATE_DIR, "github-trees"), max_bytes=64 * 1024 * 1024)
 
-def filter_easy_diffusion_posts(files):
-    return list(filter(lambda entry: entry[1].project == "easydiffusion", files))
+# the rendered posts, shared by all the publish pipelines. RENDER_CACHE_DIR (optional) also keeps them on disk,
+# e.g. on a mounted EFS volume, so that they survive cold starts
+RENDER_CACHE = MemoryStore(max_bytes=16 * 1024 * 1024)
+if os.environ.get("RENDER_CACHE_DIR"):
+    RENDER_CACHE = TieredStore(RENDER_CACHE, DiskStore(os.environ["RENDER_CACHE_DIR"], max_bytes=256 * 1024 * 1024))
 
+# stream the posts through the pipeline one at a time, instead of building the full list at each step
+STREAM_WORKFLOW = os.environ.get("STREAM_WORKFLOW", "0") == "1"
 
-def filter_freebird_posts(files):
-    return list(filter(lambda entry: entry[1].project == "freebird" and "#worklog" not in entry[1].tags, files))
+# parse the journal files in separate processes. Starting the processes costs more than parsing a typical journal,
+# so this only helps with very big journals (and needs more than one CPU, e.g. a Lambda with more memory)
+SHARDED_PARSER = os.environ.get("SHARDED_PARSER", "0") == "1"
+
+# download only the files that changed since the last sync, instead of the whole folder as a zip
+DROPBOX_INCREMENTAL_SYNC = os.environ.get("DROPBOX_INCREMENTAL_SYNC", "0") == "1"
+
+# the project of a post is the first one (in this order) that has any of the post's tags
+PROJECT_TAGS = {
+    "easydiffusion": ["#easydiffusion", "#sdkit"],
+    "freebird": ["#freebird"],
+}
+
+# the posts that are published to each blog
+ROUTES = {
+    "cmdr2": {},  # all the posts
+    "easydiffusion": {"project": "easydiffusion"},
+    "freebird": {"project": "freebird", "exclude_tags": ["#worklog"]},
+}
+
+# the CMS that the posts of each blog are rendered for
+CMS = {
+    "cmdr2": "hugo",
+    "easydiffusion": "hugo",
+    "freebird": "mkdocs",
+}
 
 
 def insert_project_crosspost_links_in_cmdr2_blog(files):
-    new_files = []
     for entry in files:
         filename, post = entry
 
         if post.project == "easydiffusion":
-            new_post_body = (
-                f"// Cross-posted from [Easy Diffusion's blog](https://easydiffusion.github.io/blog/{post.id}).\n\n"
-                + post.body
-            )
-            new_post = replace(post, body=new_post_body)
-            new_files.append((filename, new_post))
+            link = f"// Cross-posted from [Easy Diffusion's blog](https://easydiffusion.github.io/blog/{post.id}).\n\n"
+            yield filename, replace(post, prefix=(link, *post.prefix))
         elif post.project == "freebird":
             post_uri = post.time.strftime("%Y/%m/%d") + "/" + post.id
-            new_post_body = (
-                f"// Cross-posted from [Freebird's blog](https://freebirdxr.com/blog/{post_uri}).\n\n" + post.body
-            )
-            new_post = replace(post, body=new_post_body)
-            new_files.append((filename, new_post))
+            link = f"// Cross-posted from [Freebird's blog](https://freebirdxr.com/blog/{post_uri}).\n\n"
+            yield filename, replace(post, prefix=(link, *post.prefix))
         else:
-            new_files.append(entry)
-
-    return new_files
+            yield entry
 
 
 # def wait_for_threads(thread_groups):
@@ -84,30 +107,74 @@ def insert_project_crosspost_links_in_cmdr2_blog(files):
 #             thread.join()
 
 
-def run():
-    workflow = [
-        download_from_dropbox,
-        unzip_files,
-        split_blog_entries,
-        classify_posts_by_project,
+def get_state_version():
+    """
+    Returns a hash of everything that affects what's published, so that the saved state is ignored (and every post
+    is published again) when the parser, the output format, the routes or the target repos change.
+    """
+    gh_configs = [CMDR2_BLOG_GH_CONFIG, EASY_DIFFUSION_GH_CONFIG, FREEBIRD_GH_CONFIG]
+    repos = [{k: v for k, v in gh_config.items() if k != "token"} for gh_config in gh_configs]
+    config = [PARSER_VERSION, RENDER_VERSION, PROJECT_TAGS, ROUTES, CMS, repos]
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_workflow(stream=False, manifest=None, changes=None):
+    """
+    - manifest: optional `Manifest`, to skip the zip members that haven't changed since the last successful run.
+    - changes: optional `ChangeTracker`, to publish only the posts that changed since the last successful run.
+    """
+    if changes is None:
+        changes = ChangeTracker(MemoryStore())  # no previous state, so every post is published
+
+    def cpu_bound(task):
+        # sharding needs the complete input of a task, which would defeat streaming
+        return sharded(task) if SHARDED_PARSER and not stream else task
+
+    router = Router(PROJECT_TAGS, ROUTES)
+
+    def publish_pipeline(target, gh_config, *steps):
+        cms = CMS[target]
+        index = changes.index(gh_config["repo"], get_filepath)
+        return (
+            router.target(target),
+            *steps,
+            index.select,  # skip the posts that haven't changed since the last run
+            partial(convert_to_frontmatter, cms=cms, cache=RENDER_CACHE),  # the cache is shared by the pipelines
+            index.add_deletions,
+            partial(publish_to_github, **gh_config, tree_cache=GITHUB_TREE_CACHE),
+        )
+
+    if DROPBOX_INCREMENTAL_SYNC:
+        fetch_files = [download_from_dropbox.sync]
+    else:
+        fetch_files = [download_from_dropbox, partial(unzip_files.run, extensions=[".txt"], manifest=manifest)]
+
+    return [
+        *fetch_files,
+        changes.track_files,
+        cpu_bound(partial(split_blog_entries.run, cache=PARSE_CACHE)),
+        router.run,
         {  # feed the blog entries to the three publish pipelines in parallel
-            (
-                insert_project_crosspost_links_in_cmdr2_blog,
-                partial(convert_to_frontmatter, cms="hugo"),
-                partial(publish_to_github, **CMDR2_BLOG_GH_CONFIG),
-            ),
-            (
-                filter_easy_diffusion_posts,
-                partial(convert_to_frontmatter, cms="hugo"),
-                partial(publish_to_github, **EASY_DIFFUSION_GH_CONFIG),
-            ),
-            (
-                filter_freebird_posts,
-                partial(convert_to_frontmatter, cms="mkdocs"),
-                partial(publish_to_github, **FREEBIRD_GH_CONFIG),
-            ),
+            publish_pipeline("cmdr2", CMDR2_BLOG_GH_CONFIG, insert_project_crosspost_links_in_cmdr2_blog),
+            publish_pipeline("easydiffusion", EASY_DIFFUSION_GH_CONFIG),
+            publish_pipeline("freebird", FREEBIRD_GH_CONFIG),
         },
         # wait_for_threads,
     ]
 
-    _run(workflow)
+
+def run(tracer=None, stream=STREAM_WORKFLOW):
+    # only the files that changed since the last successful run are published. Both use the same version, since
+    # the posts of the files that the manifest skips can't be published again if only the change index is reset
+    version = get_state_version()
+    manifest = Manifest(DiskStore(os.path.join(STATE_DIR, "manifest")), version=version)
+    existing_files = None if DROPBOX_INCREMENTAL_SYNC else manifest.current  # sync mode reads every file
+    changes = ChangeTracker(DiskStore(os.path.join(STATE_DIR, "changes")), existing_files, version)
+
+    _run(get_workflow(stream, manifest, changes), tracer=tracer, stream=stream)
+
+    changes.save()
+    if not DROPBOX_INCREMENTAL_SYNC:
+        manifest.save()
+        print(f"Skipped {len(manifest.clean)} unchanged files")
+